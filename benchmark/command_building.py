@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+command_building measures how many commands per second map builds.
+The compiled command templates of the current implementation are compared
+with the per-file parsing of map 1.3.0, and the outputs of both
+implementations are checked for equality.
+
+Usage: ./command_building.py [number of files]
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+# pylint: disable=wrong-import-position
+from map import map_constants as mc
+from map.mapper import MapExecutor
+from map.map_argument_parser import MapArgumentParser
+
+TEMPLATES = [
+    'ls _',
+    'mv _ &:-%#',
+    'convert _ -resize 50% /tmp//out/:.png',
+    'command -p\\:\\_ -p2\\:\\% -p3\\:\\# _ ',
+    'mv _ _/../..']
+
+
+def legacy_replace_in_command(command, pattern, replacement,
+                              replacement_at_beginning):
+    """ The method is MapExecutor.replace_in_commmand of map 1.3.0."""
+    command_list = list(command)
+    indices = [index.start() for index in re.finditer(pattern, command)]
+    for index in indices:
+        if index == 0:
+            command_list[index] = replacement_at_beginning
+        elif command_list[index-1] != mc.ESCAPE_CHARACTER:
+            command_list[index] = replacement
+    return ''.join(command_list).replace("//", "/")
+
+
+def legacy_build_part(command_part, filename_with_path, count, args):
+    """ The method is MapExecutor.build_part of map 1.3.0."""
+    file_path = os.path.split(filename_with_path)[0]
+    if file_path != '':
+        file_path += '/'
+    filename_without_path = os.path.basename(filename_with_path)
+    plain_filename = os.path.splitext(filename_without_path)[0]
+    file_extension = os.path.splitext(filename_without_path)[1]
+    original_command_part = command_part
+    command_part = legacy_replace_in_command(
+        command_part, mc.PLACEHOLDER, filename_without_path,
+        filename_with_path)
+    command_part = legacy_replace_in_command(
+        command_part, mc.PLACEHOLDER_PATH, file_path, file_path)
+    command_part = legacy_replace_in_command(
+        command_part, mc.PLACEHOLDER_FILENAME, plain_filename,
+        plain_filename)
+    command_part = legacy_replace_in_command(
+        command_part, mc.PLACEHOLDER_EXTENSION, file_extension,
+        file_extension)
+    if args.number_length == 0:
+        replacement_string = str(count)
+    else:
+        replacement_string = (
+            '{0:0'+str(args.number_length)+'d}').format(count)
+    command_part = legacy_replace_in_command(
+        command_part, mc.PLACEHOLDER_COUNTER, replacement_string,
+        replacement_string)
+    if original_command_part != command_part:
+        command_part = '\"' + command_part + '\"'
+    return command_part
+
+
+def legacy_build_commands(files, args):
+    """ The method is MapExecutor.build_commands of map 1.3.0."""
+    commands = []
+    count = args.count_from
+    for filename in files:
+        escaped = filename
+        for placeholder in [mc.PLACEHOLDER, mc.PLACEHOLDER_FILENAME,
+                            mc.PLACEHOLDER_PATH, mc.PLACEHOLDER_EXTENSION,
+                            mc.PLACEHOLDER_COUNTER]:
+            escaped = escaped.replace(
+                placeholder, mc.ESCAPE_CHARACTER + placeholder)
+        parts = [legacy_build_part(part, escaped, count, args)
+                 for part in args.command.split(' ')]
+        commands.append(' '.join(parts).replace(mc.ESCAPE_CHARACTER, ''))
+        count += 1
+    return commands
+
+
+def get_files(num_files):
+    """
+    The method creates a list of file names, some of which contain
+    placeholders and special characters.
+    @param num_files: The number of file names
+    @return: The list of file names
+    """
+    names = ['file', '_:&#%', 'a b', 'noext', '.hidden', 'x{0}y']
+    extensions = ['.txt', '.jpg', '', '.tar.gz']
+    return ['data/dir' + str(index % 97) + '/' + names[index % len(names)] +
+            str(index) + extensions[index % len(extensions)]
+            for index in range(num_files)]
+
+
+def main():
+    """ The method runs the benchmark and prints the results."""
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    files = get_files(num_files)
+    parser = MapArgumentParser()
+    print('{0:<40} {1:>16} {2:>16} {3:>8}'.format(
+        'template', 'before [cmd/s]', 'after [cmd/s]', 'equal'))
+    for template in TEMPLATES:
+        args = parser.parse_args(['-n', '3', '-c', '7', template])
+        start = time.time()
+        before = legacy_build_commands(files, args)
+        before_rate = num_files / (time.time() - start)
+        start = time.time()
+        after = MapExecutor().build_commands(files, args)
+        after_rate = num_files / (time.time() - start)
+        print('{0:<40} {1:>16.0f} {2:>16.0f} {3:>8}'.format(
+            template, before_rate, after_rate, str(before == after)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""
+run_benchmarks is the benchmark suite of map. It creates synthetic trees of
+different sizes and measures each stage of a map run separately:
+
+walk:      traversing the tree (MapInputHandler.iter_entries)
+filter:    collecting, filtering and sorting the input
+           (MapInputHandler.get_entries with -x)
+build:     building the commands (MapExecutor.iter_jobs)
+execute:   executing a no-op command (MapExecutor.run_jobs)
+
+Each measurement runs in a separate process so that the peak resident set
+size (RSS) can be attributed to a single stage. The results are printed as a
+table and can be written to a JSON file, which can be compared with the
+results of a previous run, e.g., of an older release:
+
+./run_benchmarks.py --files 10000,100000 --output new.json --compare old.json
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIRECTORY, '..'))
+
+# pylint: disable=wrong-import-position
+from map.mapper import MapExecutor, MapInputHandler
+from map.map_argument_parser import MapArgumentParser, get_version_info
+from synthetic_tree import create_tree, parse_extension_mix
+
+STAGES = ['walk', 'filter', 'build', 'execute']
+
+
+def get_peak_rss():
+    """
+    The method returns the peak resident set size of the current process.
+    @return: The peak RSS in kilobytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The value is reported in bytes on macOS:
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def run_stage(stage, root, exec_files):
+    """
+    The method runs a single stage on the tree under 'root'.
+    @param stage: The name of the stage
+    @param root: The root of the synthetic tree
+    @param exec_files: The maximum number of files processed by 'execute'
+    @return: Tuple of the number of processed items and the elapsed time
+    """
+    parser = MapArgumentParser()
+    handler = MapInputHandler()
+    executor = MapExecutor()
+    if stage == 'walk':
+        args = parser.parse_args(['-r', 'true _', root])
+        start = time.time()
+        count = sum(1 for _ in handler.iter_entries(args))
+        return count, time.time() - start
+    if stage == 'filter':
+        args = parser.parse_args(['-r', '-x', 'txt,jpg', 'true _', root])
+        start = time.time()
+        count = len(handler.get_entries(args))
+        return count, time.time() - start
+    if stage == 'build':
+        args = parser.parse_args(['-r', '-n', '6', 'mv _ &:-%#', root])
+        entries = handler.get_entries(args)
+        start = time.time()
+        count = sum(1 for _ in executor.iter_jobs(entries, args))
+        return count, time.time() - start
+    args = parser.parse_args(['-r', '-j', '0', '--no-shell', 'true _', root])
+    entries = handler.get_entries(args)[:exec_files]
+    jobs = list(executor.iter_jobs(entries, args))
+    start = time.time()
+    executor.run_jobs(jobs, args)
+    return len(jobs), time.time() - start
+
+
+def measure(stage, root, exec_files):
+    """
+    The method runs a stage in a separate process.
+    @param stage: The name of the stage
+    @param root: The root of the synthetic tree
+    @param exec_files: The maximum number of files processed by 'execute'
+    @return: Dictionary with the items, the time, and the peak RSS
+    """
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--run-stage', stage,
+         '--exec-files', str(exec_files), root])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def compare(results, baseline_filename):
+    """
+    The method prints the throughput of the current results relative to the
+    results stored in a previous JSON file.
+    @param results: The current results
+    @param baseline_filename: The JSON file of a previous run
+    """
+    with open(baseline_filename) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = dict(((result['files'], result['stage']), result)
+                    for result in baseline['results'])
+    print('\nComparison with ' + baseline_filename + ' (map ' +
+          baseline['map_version'] + '):')
+    print('{0:>10} {1:<8} {2:>16} {3:>16} {4:>8}'.format(
+        'files', 'stage', 'before [1/s]', 'after [1/s]', 'ratio'))
+    for result in results:
+        old = previous.get((result['files'], result['stage']))
+        if old is None or not old['throughput']:
+            continue
+        print('{0:>10} {1:<8} {2:>16.0f} {3:>16.0f} {4:>8.2f}'.format(
+            result['files'], result['stage'], old['throughput'],
+            result['throughput'], result['throughput'] / old['throughput']))
+
+
+def main():
+    """ The method parses the arguments and runs the benchmarks."""
+    parser = argparse.ArgumentParser(description='The benchmark suite of map.')
+    parser.add_argument('--files', default='10000,100000', help='comma-'
+                        'separated list of tree sizes (default: 10000,100000)')
+    parser.add_argument('--depth', type=int, default=3, help='number of '
+                        'directory levels (default: 3)')
+    parser.add_argument('--fan-out', type=int, default=8, help='number of '
+                        'subdirectories per directory (default: 8)')
+    parser.add_argument('--extensions', default='txt:4,jpg:2,abc:1,:1',
+                        help='extension mix as comma-separated ext:weight '
+                        'pairs, an empty extension stands for files without '
+                        'extension (default: txt:4,jpg:2,abc:1,:1)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-'
+                        'separated list of stages (default: all)')
+    parser.add_argument('--exec-files', type=int, default=2000, help='number '
+                        'of files processed by the execute stage (default: '
+                        '2000)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='JSON', help='compare the results '
+                        'with a previous JSON file')
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    parser.add_argument('root', nargs='?', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    # A single stage is run in a child process:
+    if options.run_stage:
+        items, elapsed = run_stage(options.run_stage, options.root,
+                                   options.exec_files)
+        sys.stdout.flush()
+        print(json.dumps({'items': items, 'time': elapsed,
+                          'peak_rss_kb': get_peak_rss()}))
+        return
+
+    extensions = parse_extension_mix(options.extensions)
+    stages = options.stages.split(',')
+    results = []
+    print('{0:>10} {1:<8} {2:>10} {3:>10} {4:>14} {5:>14}'.format(
+        'files', 'stage', 'items', 'time [s]', 'items/s', 'peak RSS [MB]'))
+    for num_files in [int(value) for value in options.files.split(',')]:
+        root = tempfile.mkdtemp(prefix='map_benchmark_')
+        try:
+            create_tree(root, num_files, options.depth, options.fan_out,
+                        extensions)
+            for stage in stages:
+                result = measure(stage, root, options.exec_files)
+                result.update({
+                    'files': num_files, 'stage': stage,
+                    'throughput': result['items'] / result['time']
+                                  if result['time'] > 0 else 0.0})
+                results.append(result)
+                print('{0:>10} {1:<8} {2:>10} {3:>10.3f} {4:>14.0f} '
+                      '{5:>14.1f}'.format(
+                          num_files, stage, result['items'], result['time'],
+                          result['throughput'],
+                          result['peak_rss_kb'] / 1024.0))
+        finally:
+            shutil.rmtree(root)
+
+    report = {
+        'map_version': get_version_info()['__version__'],
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {'depth': options.depth, 'fan_out': options.fan_out,
+                       'extensions': options.extensions,
+                       'exec_files': options.exec_files},
+        'results': results}
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+shell_overhead compares the number of files processed per second when the
+commands are executed via the shell and when they are executed directly
+(--no-shell).
+
+Usage: ./shell_overhead.py [number of files] [command]
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+# pylint: disable=wrong-import-position
+from map.mapper import MapExecutor, MapInputHandler
+from map.map_argument_parser import MapArgumentParser
+from synthetic_tree import create_tree
+
+
+def main():
+    """ The method runs the benchmark and prints the results."""
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    command = sys.argv[2] if len(sys.argv) > 2 else 'touch _'
+    root = tempfile.mkdtemp(prefix='map_shell_overhead_')
+    try:
+        create_tree(root, num_files, depth=1)
+        parser = MapArgumentParser()
+        print('{0:<24} {1:>14}'.format('mode', 'files/s'))
+        for mode, options in [('shell', []), ('no shell', ['--no-shell']),
+                              ('shell -j 0', ['-j', '0']),
+                              ('no shell -j 0', ['--no-shell', '-j', '0'])]:
+            args = parser.parse_args(options + ['-r', command, root])
+            files = MapInputHandler().get_files(args)
+            executor = MapExecutor()
+            start = time.time()
+            executor.run_commands(executor.build_commands(files, args), args)
+            rate = len(files) / (time.time() - start)
+            print('{0:<24} {1:>14.0f}'.format(mode, rate))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
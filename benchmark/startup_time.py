@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+startup_time measures how long map takes to start, i.e., the median time of
+'map -V' and of 'map -l' on a single file, and compares it to the startup
+of the interpreter itself ('python -c pass'). The script fails if the
+overhead of map exceeds the target.
+
+Usage: ./startup_time.py [number of runs]
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+# The maximum startup time of map beyond the startup of the interpreter in
+# milliseconds:
+STARTUP_OVERHEAD_TARGET_MS = 50.0
+
+MAP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          'map', 'map')
+
+
+def measure(command, runs, environment):
+    """ The method runs a command repeatedly.
+    @param command: The command as a list of arguments
+    @param runs: The number of runs
+    @param environment: The environment of the command
+    @return: The median duration in milliseconds
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.call(command, stdout=subprocess.PIPE, env=environment)
+        durations.append((time.time() - start) * 1000.0)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def main():
+    """ The method runs the benchmark and prints the results."""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 21
+    environment = dict(os.environ, PYTHONPATH=os.path.join(
+        os.path.dirname(MAP_SCRIPT), '..'))
+    # The compiled modules must be cached, as in an installation of map:
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+    root = tempfile.mkdtemp(prefix='map_startup_time_')
+    try:
+        open(os.path.join(root, 'file.txt'), 'w').close()
+        commands = [('python -c pass', [sys.executable, '-c', 'pass']),
+                    ('map -V', [sys.executable, MAP_SCRIPT, '-V']),
+                    ('map -l', [sys.executable, MAP_SCRIPT, '-l', 'echo _',
+                                root])]
+        # The first run caches the compiled modules if necessary:
+        for _, command in commands:
+            measure(command, 1, environment)
+        baseline = None
+        overhead = 0.0
+        print('{0:<24} {1:>12} {2:>12}'.format('command', 'median [ms]',
+                                               'overhead'))
+        for name, command in commands:
+            duration = measure(command, runs, environment)
+            if baseline is None:
+                baseline = duration
+            overhead = max(overhead, duration - baseline)
+            print('{0:<24} {1:>12.1f} {2:>12.1f}'.format(
+                name, duration, duration - baseline))
+    finally:
+        shutil.rmtree(root)
+    print('Target: at most ' + '{0:g}'.format(STARTUP_OVERHEAD_TARGET_MS) +
+          ' ms overhead.')
+    if overhead > STARTUP_OVERHEAD_TARGET_MS:
+        print('The startup of map exceeds the target.')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+stat_calls counts the file system calls that are issued per entry when
+collecting the input for map. The current implementation of
+MapInputHandler.get_files is compared with the os.walk/os.path.isfile based
+implementation of map 1.3.0.
+
+Usage: ./stat_calls.py [number of files]
+
+Note that only the calls issued from Python are counted. The file type
+information of os.DirEntry objects is provided by the directory listing
+itself on most file systems.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+# pylint: disable=wrong-import-position
+from map.mapper import MapInputHandler
+from map.map_argument_parser import MapArgumentParser
+from synthetic_tree import create_tree
+
+COUNTED_FUNCTIONS = ['stat', 'lstat', 'listdir', 'scandir']
+
+
+def legacy_get_files(args):
+    """
+    The method collects the input files the way map 1.3.0 does it.
+    Only the code paths used by this benchmark are reproduced.
+    @param args: The map arguments
+    @return: List of files
+    """
+    handler = MapInputHandler()
+    result_list = []
+    if args.recursive:
+        directory_dict = handler.get_directory_dictionary(args)
+        for key in directory_dict:
+            for path, directories, files in os.walk(key):
+                for directory in directories:
+                    result_list.append(os.path.join(path, directory))
+                for filename in files:
+                    pattern = directory_dict[key].split(',')
+                    if 'ALL' in pattern or \
+                       os.path.splitext(filename)[1] in pattern:
+                        result_list.append(os.path.join(path, filename))
+    elif len(args.path) == 1 and os.path.isdir(args.path[0]):
+        result_list = [os.path.join(args.path[0], f)
+                       for f in os.listdir(args.path[0])]
+    else:
+        result_list = args.path
+    file_list = [element for element in set(result_list)
+                 if os.path.isfile(element)]
+    return sorted(file_list)
+
+
+def count_calls(function, args):
+    """
+    The method runs the given function and counts the calls of the functions
+    listed in COUNTED_FUNCTIONS.
+    @param function: The function that collects the input
+    @param args: The map arguments
+    @return: Tuple of the result, the call counts, and the elapsed time
+    """
+    counts = dict((name, 0) for name in COUNTED_FUNCTIONS)
+    originals = dict((name, getattr(os, name)) for name in COUNTED_FUNCTIONS)
+
+    def make_wrapper(name):
+        """ The method returns a counting wrapper for os.<name>."""
+        def wrapper(*arguments, **keywords):
+            """ The wrapper counts the call and forwards it."""
+            counts[name] += 1
+            return originals[name](*arguments, **keywords)
+        return wrapper
+
+    for name in COUNTED_FUNCTIONS:
+        setattr(os, name, make_wrapper(name))
+    try:
+        start = time.time()
+        result = function(args)
+        elapsed = time.time() - start
+    finally:
+        for name in COUNTED_FUNCTIONS:
+            setattr(os, name, originals[name])
+    return result, counts, elapsed
+
+
+def main():
+    """ The method runs the benchmark and prints the results."""
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    root = tempfile.mkdtemp(prefix='map_stat_calls_')
+    try:
+        directories = create_tree(root, num_files)
+        num_entries = num_files + len(directories) - 1
+        print('Tree with ' + str(num_files) + ' files in ' +
+              str(len(directories)) + ' directories.')
+        parser = MapArgumentParser()
+        cases = [
+            ('recursive', parser.parse_args(['-r', 'true', root])),
+            ('recursive -x txt', parser.parse_args(
+                ['-r', '-x', 'txt', 'true', root])),
+            ('flat', parser.parse_args(['true', root]))]
+        print('{0:<18} {1:<8} {2:>9} {3:>9} {4:>12} {5:>9}'.format(
+            'case', 'variant', 'entries', 'stat', 'stat/entry', 'time [s]'))
+        for name, args in cases:
+            entries = num_entries if args.recursive else \
+                len(os.listdir(root))
+            for variant, function in [
+                    ('before', legacy_get_files),
+                    ('after', MapInputHandler().get_files)]:
+                _, counts, elapsed = count_calls(function, args)
+                stat_calls = counts['stat'] + counts['lstat']
+                print('{0:<18} {1:<8} {2:>9} {3:>9} {4:>12.3f} {5:>9.3f}'
+                      .format(name, variant, entries, stat_calls,
+                              float(stat_calls) / entries, elapsed))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
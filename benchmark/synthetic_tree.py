@@ -0,0 +1,58 @@
+"""
+synthetic_tree creates directory trees with empty files that are used as the
+input for the map benchmarks.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import os
+
+
+def create_tree(root, num_files, depth=3, fan_out=4,
+                extensions=('.txt', '.jpg', '.abc', '')):
+    """
+    The method creates a tree of empty files under 'root'. The files are
+    distributed evenly over all directories of the tree, and the extensions
+    are assigned in a round-robin fashion.
+    @param root: The directory where the tree is created
+    @param num_files: The total number of files
+    @param depth: The number of directory levels below the root
+    @param fan_out: The number of subdirectories per directory
+    @param extensions: The extensions of the created files
+    @return: The list of created directories including the root
+    """
+    directories = [root]
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for index in range(fan_out):
+                next_level.append(os.path.join(parent, 'dir' + str(index)))
+        directories.extend(next_level)
+        level = next_level
+    for directory in directories:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    for index in range(num_files):
+        directory = directories[index % len(directories)]
+        extension = extensions[index % len(extensions)]
+        filename = os.path.join(directory, 'file' + str(index) + extension)
+        open(filename, 'w').close()
+    return directories
+
+
+def parse_extension_mix(mix):
+    """
+    The method turns an extension mix such as 'txt:3,jpg:1,:1' into a tuple
+    of extensions in which each extension occurs as often as its weight.
+    An empty extension stands for files without an extension, and the
+    weight defaults to 1.
+    @param mix: The comma-separated list of extensions with weights
+    @return: The tuple of extensions
+    """
+    extensions = []
+    for item in mix.split(','):
+        name, _, weight = item.partition(':')
+        extension = '.' + name if name else ''
+        extensions.extend([extension] * int(weight or 1))
+    return tuple(extensions)
@@ -1 +1,4 @@
-__all__ = ['map_argument_parser', 'map_constants', 'mapper', 'version']
+__all__ = ['map_adaptive', 'map_api', 'map_argument_parser', 'map_asyncio',
+           'map_constants', 'map_filter', 'map_journal', 'map_listing_cache',
+           'map_result_cache', 'map_stats', 'map_watch', 'map_worker',
+           'mapper', 'version']
@@ -0,0 +1,215 @@
+"""
+map_adaptive adjusts the number of commands that map runs in parallel to
+the load of the system.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import time
+import collections
+from map import map_constants as mc
+
+# A MapLoadSample describes the load of the system: the load average of the
+# last minute per core, and the share of time in percent in which some tasks
+# were stalled on the CPU, I/O, and memory during the last ten seconds
+# (pressure stall information). Values that are not available are None.
+MapLoadSample = collections.namedtuple(
+    'MapLoadSample', ['load', 'cpu', 'io', 'memory'])
+
+
+class MapSystemLoad(object):
+    """
+    MapSystemLoad reads the load of the system from /proc/loadavg and
+    /proc/pressure. On systems without these files, os.getloadavg is used
+    and the pressure is unknown.
+    """
+
+    def __init__(self, proc_directory='/proc'):
+        """
+        The constructor creates a MapSystemLoad object.
+        @param proc_directory: The directory where procfs is mounted
+        """
+        self.proc_directory = proc_directory
+        self.cores = os.cpu_count() or 1
+
+    def read_load(self):
+        """
+        This method reads the load average of the last minute.
+        @return: The load average per core, or None if it is not available
+        """
+        try:
+            with open(os.path.join(self.proc_directory, 'loadavg')) as \
+                    load_file:
+                load = float(load_file.read().split()[0])
+        except (IOError, OSError, ValueError, IndexError):
+            try:
+                load = os.getloadavg()[0]
+            except (AttributeError, OSError):
+                return None
+        return load / self.cores
+
+    def read_pressure(self, resource):
+        """
+        This method reads the pressure stall information of a resource.
+        @param resource: 'cpu', 'io', or 'memory'
+        @return: The 'some avg10' value in percent, or None if it is not
+            available
+        """
+        try:
+            with open(os.path.join(self.proc_directory, 'pressure',
+                                   resource)) as pressure_file:
+                for line in pressure_file:
+                    fields = line.split()
+                    if fields and fields[0] == 'some':
+                        for field in fields[1:]:
+                            key, _, value = field.partition('=')
+                            if key == 'avg10':
+                                return float(value)
+        except (IOError, OSError, ValueError):
+            pass
+        return None
+
+    def sample(self):
+        """
+        This method determines the current load of the system.
+        @return: The MapLoadSample
+        """
+        return MapLoadSample(self.read_load(), self.read_pressure('cpu'),
+                             self.read_pressure('io'),
+                             self.read_pressure('memory'))
+
+
+class MapConcurrencyController(object):
+    """
+    MapConcurrencyController determines how many commands may run in
+    parallel. Starting at a baseline, the limit is adjusted at regular
+    intervals:
+
+        record(completed)   counts the completed commands, and
+        update(running)     adjusts the limit if the interval has passed.
+
+    If the system is overloaded, the limit is reduced multiplicatively. If
+    the system has spare capacity and all slots were in use, the limit is
+    increased by one, unless the previous increase reduced the throughput,
+    in which case it is undone. The limit stays within the given bounds.
+    The load source and the clock can be replaced, e.g., to simulate load.
+    """
+
+    def __init__(self, initial, minimum, maximum, load_source=None,
+                 interval=mc.ADAPTIVE_INTERVAL, clock=time.time, log=None):
+        """
+        The constructor creates a MapConcurrencyController object.
+        @param initial: The initial limit
+        @param minimum: The minimum limit
+        @param maximum: The maximum limit
+        @param load_source: An object whose sample() method returns a
+            MapLoadSample, by default a MapSystemLoad
+        @param interval: The number of seconds between two adjustments
+        @param clock: The function that returns the current time
+        @param log: The function that is called with a message whenever the
+            limit changes, or None
+        """
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.load_source = load_source if load_source is not None \
+            else MapSystemLoad()
+        self.interval = interval
+        self.clock = clock
+        self.log = log
+        self.last_update = clock()
+        self.completed = 0
+        self.last_throughput = None
+        self.last_change = 0
+
+    def record(self, completed):
+        """
+        This method counts completed commands.
+        @param completed: The number of commands that have completed
+        """
+        self.completed += completed
+
+    def is_overloaded(self, sample):
+        """
+        This method checks whether the system is overloaded.
+        @param sample: The MapLoadSample
+        @return: True if any of the values exceeds its upper threshold
+        """
+        return exceeds(sample.load, mc.ADAPTIVE_LOAD_HIGH) or \
+            exceeds(sample.cpu, mc.ADAPTIVE_PRESSURE_HIGH) or \
+            exceeds(sample.io, mc.ADAPTIVE_PRESSURE_HIGH) or \
+            exceeds(sample.memory, mc.ADAPTIVE_MEMORY_PRESSURE_HIGH)
+
+    def has_capacity(self, sample):
+        """
+        This method checks whether the system has spare capacity.
+        @param sample: The MapLoadSample
+        @return: True if none of the values exceeds its lower threshold
+        """
+        return not (exceeds(sample.load, mc.ADAPTIVE_LOAD_LOW) or
+                    exceeds(sample.cpu, mc.ADAPTIVE_PRESSURE_LOW) or
+                    exceeds(sample.io, mc.ADAPTIVE_PRESSURE_LOW) or
+                    exceeds(sample.memory, mc.ADAPTIVE_PRESSURE_LOW))
+
+    def update(self, running):
+        """
+        This method adjusts the limit if the interval has passed since the
+        last adjustment.
+        @param running: The number of commands that are currently running
+        @return: The limit
+        """
+        now = self.clock()
+        elapsed = now - self.last_update
+        if elapsed < self.interval:
+            return self.limit
+        throughput = self.completed / elapsed
+        sample = self.load_source.sample()
+        limit = self.limit
+        if self.is_overloaded(sample):
+            limit = min(limit - 1, int(limit * mc.ADAPTIVE_DECREASE))
+        elif self.last_change > 0 and self.last_throughput is not None and \
+                throughput < self.last_throughput * \
+                mc.ADAPTIVE_THROUGHPUT_TOLERANCE:
+            limit -= 1
+        elif self.has_capacity(sample) and running >= limit:
+            limit += 1
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit != self.limit and self.log is not None:
+            self.log('Concurrency: ' + str(self.limit) + ' -> ' + str(limit) +
+                     ' (' + format_sample(sample) + ', ' +
+                     '{0:.1f}'.format(throughput) + ' commands/s).')
+        self.last_change = limit - self.limit
+        self.last_throughput = throughput
+        self.limit = limit
+        self.last_update = now
+        self.completed = 0
+        return limit
+
+
+def exceeds(value, threshold):
+    """
+    The method checks whether a value is known and above a threshold.
+    @param value: The value or None
+    @param threshold: The threshold
+    @return: True if the value exceeds the threshold
+    """
+    return value is not None and value > threshold
+
+
+def format_sample(sample):
+    """
+    The method formats a load sample for the log.
+    @param sample: The MapLoadSample
+    @return: The formatted sample
+    """
+    values = []
+    for name, value in zip(sample._fields, sample):
+        if value is None:
+            continue
+        if name == 'load':
+            values.append('load ' + '{0:.2f}'.format(value) + ' per core')
+        else:
+            values.append(name + ' pressure ' + '{0:.1f}'.format(value) + '%')
+    return ', '.join(values) if values else 'load unknown'
@@ -0,0 +1,157 @@
+"""
+map_api is the Python interface of map. It runs map within the calling
+process, without parsing a command line, and returns the results of the
+commands as they become available:
+
+    from map import map_api
+    for result in map_api.map_files('gzip -9 _', ['/path/to/folder'],
+                                    extensions='txt', recursive=True, jobs=4):
+        print(result.path, result.return_code, result.duration)
+
+The command line interface (MapStarter) and this interface are both built on
+MapRunner.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import argparse
+import collections
+from map.map_argument_parser import MapArgumentParser
+from map.mapper import MapRunner
+
+# The result of a command. The files are the input of the command, which is
+# a single file unless batching is enabled, and the path is the first file.
+# A command that was killed after the timeout is timed out.
+# If the output is captured, 'output' and 'error_output' are temporary files
+# opened in binary mode and positioned at the beginning. Otherwise, they are
+# None and the command writes to the standard output and error directly:
+MapResult = collections.namedtuple(
+    'MapResult', ['path', 'files', 'command', 'return_code', 'timed_out',
+                  'duration', 'output', 'error_output'])
+
+# The default values of all options, which are taken from the argument parser
+# when they are needed for the first time:
+DEFAULT_OPTIONS = None
+
+
+def get_default_options():
+    """
+    The method returns the default values of all options of map.
+    @return: Dictionary mapping the option names, e.g., 'count_from', to
+        their default values
+    """
+    global DEFAULT_OPTIONS  # pylint: disable=global-statement
+    if DEFAULT_OPTIONS is None:
+        options = vars(MapArgumentParser().parse_args(['']))
+        del options['command']
+        del options['path']
+        DEFAULT_OPTIONS = options
+    return DEFAULT_OPTIONS
+
+
+def make_arguments(command, paths, **options):
+    """
+    The method creates the arguments of a map run without parsing a command
+    line. The options are named after the long command line options with
+    dashes replaced by underscores, e.g., count_from=1 for '--count-from 1'.
+    A ValueError is raised for unknown options.
+    @param command: The command containing placeholders
+    @param paths: The path or list of paths where the input is found
+    @param options: The options that differ from their default values
+    @return: The map arguments
+    """
+    arguments = dict(get_default_options())
+    for name in options:
+        if name not in arguments:
+            raise ValueError('unknown option: ' + name)
+    arguments.update(options)
+    arguments['command'] = command
+    arguments['path'] = [paths] if isinstance(paths, str) else list(paths)
+    return argparse.Namespace(**arguments)
+
+
+def map_files(command, paths, extensions=None, recursive=False,
+              directories=False, jobs=1, capture_output=None, **options):
+    """
+    The method applies a command to all files (or directories) under the
+    given paths and returns an iterator over the results. The commands are
+    executed lazily, i.e., only as the results are consumed, and the results
+    of parallel commands are returned in the order in which the commands
+    finish. Unless ignore_errors=True is given, no new commands are started
+    after the first failure.
+    A ValueError is raised right away if the options are invalid, and an
+    IOError is raised if a file given in the options cannot be opened.
+    @param command: The command containing placeholders
+    @param paths: The path or list of paths where the input is found
+    @param extensions: The comma-separated extensions of the input files,
+        or None for all files
+    @param recursive: If True, the input is searched recursively
+    @param directories: If True, the command is applied to directories
+    @param jobs: The maximum number of concurrent commands, 0 for one per
+        available core
+    @param capture_output: If True, the output of each command is returned
+        in temporary files. By default, the output is captured unless a
+        worker is used, whose replies are not the output of a command.
+    @param options: Further options named after the long command line
+        options, e.g., count_from=1 or no_shell=True
+    @return: Iterator of MapResult objects
+    """
+    if capture_output is None:
+        capture_output = options.get('worker') is None
+    elif capture_output and options.get('worker') is not None:
+        raise ValueError('the output cannot be captured with a worker')
+    args = make_arguments(command, paths, extensions=extensions,
+                          recursive=recursive, directories=directories,
+                          jobs=jobs, group_output=capture_output, **options)
+    return iter_results(MapRunner(args))
+
+
+def list_commands(command, paths, **options):
+    """
+    The method returns an iterator over the commands that map_files()
+    would execute, without executing them. A command that is executed
+    without a shell is a list of arguments.
+    @param command: The command containing placeholders
+    @param paths: The path or list of paths where the input is found
+    @param options: The options, as accepted by map_files()
+    @return: Iterator of commands
+    """
+    return iter_commands(MapRunner(make_arguments(command, paths,
+                                                  **options)))
+
+
+def iter_commands(runner):
+    """
+    The method yields the commands of a run without executing them. The
+    run is finished when the commands have been consumed or the iterator is
+    closed.
+    @param runner: The MapRunner
+    @return: Generator of commands
+    """
+    try:
+        for job in runner.get_jobs(runner.get_entries()):
+            yield job.command
+    finally:
+        runner.finish()
+
+
+def iter_results(runner):
+    """
+    The method executes the jobs of a run and yields their results. The
+    run is finished when the results have been consumed or the iterator is
+    closed.
+    @param runner: The MapRunner
+    @return: Generator of MapResult objects
+    """
+    try:
+        jobs = runner.get_jobs(runner.get_entries())
+        for job, result in runner.executor.iter_results(jobs, runner.args):
+            for output in (result.output, result.error_output):
+                if output is not None:
+                    output.seek(0)
+            yield MapResult(job.files[0] if job.files else None, job.files,
+                            job.command, result.return_code,
+                            result.timed_out, result.duration, result.output,
+                            result.error_output)
+    finally:
+        runner.finish()
@@ -6,6 +6,7 @@ Information about map is available at https://github.com/THLO/map.
 """
 
 import os
+import sys
 import argparse
 from argparse import ArgumentParser
 from map import map_constants as mc
@@ -17,38 +18,31 @@ class MapArgumentParser(ArgumentParser):
 
     def __init__(self):
         """ The constructor creates a MapArgumentParser object."""
-        description_string = "The given command is applied to all " \
-        "files/directories under the provided path.\nThe command must be set " \
-        "in quotation marks.\n\nplaceholders:\n"+mc.PLACEHOLDER+ \
-        " is used as the placeholder for the current matching file including " \
-        "the full path.\n"+mc.PLACEHOLDER_FILENAME+" is used as the " \
-        "placeholder for the current file's name without its path or " \
-        "extension.\n"+mc.PLACEHOLDER_PATH+" is used as the " \
-        "placeholder for the current file's path.\n"+ \
-        mc.PLACEHOLDER_EXTENSION+" is used as the placeholder for " \
-        "the current file's extension including the dot.\n" + \
-        mc.PLACEHOLDER_COUNTER_HELP_TEXT+" is used to refer to " \
-        "an internal counter, incremented after each command.\n\n" \
-        "Examples:\n  map \"mv " + mc.PLACEHOLDER + " " + \
-        mc.PLACEHOLDER_PATH + mc.PLACEHOLDER_FILENAME + \
-        mc.PLACEHOLDER_COUNTER_HELP_TEXT + \
-        mc.PLACEHOLDER_EXTENSION + "\" /path/to/folder: A counter " \
-        "is added to all file names.\n  map -r \"mv "+ \
-        mc.PLACEHOLDER + " " + mc.PLACEHOLDER_PATH + \
-        "/..\" /path/to/folder: Each file is moved to its respective " \
-        "parent directory."
+        # The description is only built if the help is printed:
         super(MapArgumentParser, self).__init__(
-            description=description_string, formatter_class=\
-            argparse.RawDescriptionHelpFormatter)
-        # Get the version information:
-        info = get_version_info()
-        # Extract the version number:
-        version = info['__version__']
-        # Extract the version text:
-        version_text = info['__version_text__']
+            formatter_class=argparse.RawDescriptionHelpFormatter)
         # Add all arguments:
         # Get a group for the mutually exclusive options '-x' and '-d':
         group_xd = self.add_mutually_exclusive_group()
+        # Add the arguments for the adaptive concurrency:
+        self.add_argument("--adaptive", action="store_true", help="adjust \
+            the number of commands that run in parallel to the load of the \
+            system, starting at the value of -j. The number is reduced when \
+            the load average or the CPU, I/O, or memory pressure is high, \
+            and it is increased while the system has spare capacity and the \
+            throughput improves.")
+        self.add_argument("--min-jobs", type=check_negative, default=1, \
+            metavar="N", help="run at least N commands in parallel with \
+            --adaptive.")
+        self.add_argument("--max-jobs", type=check_negative, default=0, \
+            metavar="N", help="run at most N commands in parallel with \
+            --adaptive. The value 0 stands for " + \
+            str(mc.ADAPTIVE_MAX_JOBS_PER_CORE) + " per available core.")
+        # Add the argument "-b" to process multiple files per command:
+        self.add_argument("-b", "--batch", action="store_true", \
+            help="process as many files per command as the system allows. \
+            Each part of the command that contains placeholders is repeated \
+            for every file in the batch.")
         # Add the argument "-c" to set the counter:
         self.add_argument("-c", "--count-from", type=check_negative, default=0,\
             help="set the internal counter to the provided start value.")
@@ -62,28 +56,187 @@ class MapArgumentParser(ArgumentParser):
             applied to all files under the provided path. The symbol '" + \
             mc.PLACEHOLDER_NO_EXTENSION_FILTER+"' is used to filter for \
             files without an extension.")
+        # Add the argument "--dedup-inodes" to process each file only once:
+        self.add_argument("--dedup-inodes", action="store_true", \
+            help="apply the command only once to each file (or directory), \
+            even if it is reached through several paths, e.g., through hard \
+            links, symbolic links, bind mounts, or overlapping paths. Files \
+            are identified by their device and inode.")
+        # Add the argument "--engine" to select how commands are executed:
+        self.add_argument("--engine", choices=mc.ENGINES, \
+            default=mc.ENGINE_THREADS, help="set the engine that executes \
+            the commands. '" + mc.ENGINE_THREADS + "' waits for each command \
+            in a separate thread, whereas '" + mc.ENGINE_ASYNCIO + "' waits \
+            for all commands in a single thread, which is suitable for many \
+            parallel commands.")
+        # Add the argument "--events" to write a stream of JSON events:
+        self.add_argument("--events", metavar="FILE", help="append a JSON \
+            line for each executed command and a summary at the end to the \
+            given file ('-' for the standard error).")
+        # Add the argument "--follow-symlinks" to search linked directories:
+        self.add_argument("--follow-symlinks", action="store_true", \
+            help="search the directories that symbolic links point to when \
+            searching recursively. Each directory is searched only once, so \
+            that cycles of links are not followed.")
+        # Add the arguments to read the input from a file:
+        self.add_argument("--from-file", metavar="FILE", help="read the \
+            input files (or directories) from the given file ('-' for the \
+            standard input), one path per line, instead of searching the \
+            provided path. The paths are processed in the order in which \
+            they are read, which implies -s.")
+        self.add_argument("-0", "--null", action="store_true", help="the \
+            paths read with --from-file, as well as the requests and replies \
+            of workers, are separated by null characters instead of \
+            newlines, like the output of 'find -print0'.")
+        # Add the arguments to exclude and include entries:
+        self.add_argument("--exclude", action="append", metavar="PATTERN", \
+            help="ignore the files and directories that match the given \
+            glob pattern. Excluded directories are not searched. Patterns \
+            without a slash are matched against the name, other patterns \
+            against the path relative to the provided path. This option can \
+            be given multiple times.")
+        self.add_argument("--include", action="append", metavar="PATTERN", \
+            help="only apply the command to the files (or directories) that \
+            match the given glob pattern. All directories are still \
+            searched. This option can be given multiple times.")
+        self.add_argument("--regex", action="store_true", help="the \
+            patterns of --exclude and --include are regular expressions that \
+            are searched in the path relative to the provided path.")
+        # Add the argument "-g" to group the output of each command:
+        self.add_argument("-g", "--group-output", action="store_true", \
+            help="write the output of each command in one piece after the \
+            command has finished, even if commands run in parallel. The \
+            output is buffered in temporary files.")
         # Add the argument "-i" to ignore errors:
         self.add_argument("-i", "--ignore-errors", action="store_true", \
             help="continue to execute commands even when a command has failed.")
+        # Add the argument "-j" to run commands in parallel:
+        self.add_argument("-j", "--jobs", type=check_negative, default=1, \
+            help="run up to the given number of commands in parallel. The \
+            value 0 uses one job per available core.")
+        # Add the argument "--journal" to resume interrupted runs:
+        self.add_argument("--journal", metavar="FILE", help="record the \
+            successfully processed files in the given journal file. Files \
+            that are recorded in the journal and have not changed since are \
+            skipped, which allows resuming an interrupted run.")
         # Add the argument "-l" to list commands without executing them:
         self.add_argument("-l", "--list", action="store_true", \
             help="list all commands without executing them.")
+        # Add the argument "--max-batch" to limit the batch size:
+        self.add_argument("--max-batch", type=check_negative, default=0, \
+            metavar="N", help="process at most N files per command. This \
+            option implies -b.")
+        # Add the argument "--max-depth" to limit the recursion:
+        self.add_argument("--max-depth", type=check_negative, default=0, \
+            metavar="N", help="only search N levels below the provided path \
+            when searching recursively, where 1 stands for the entries of the \
+            provided path itself. The value 0 stands for no limit.")
+        # Add the arguments for the listing cache:
+        self.add_argument("--listing-cache", metavar="FILE", help="cache \
+            the directory listings in the given file. Directories that have \
+            not changed since the previous run are not read again.")
+        self.add_argument("--listing-cache-size", type=check_negative, \
+            default=mc.LISTING_CACHE_SIZE, metavar="N", help="keep at most \
+            N entries in the listing cache. The listings that were used \
+            least recently are evicted first.")
+        self.add_argument("--refresh-cache", action="store_true", \
+            help="read all directories again and replace the listing cache.")
         # Add the argument "-n" to specify the number of digits for the counter:
         self.add_argument("-n", "--number-length", type=check_negative, \
             default=0, help="format the counter that is used with " + \
             mc.PLACEHOLDER_COUNTER_HELP_TEXT+". The argument is \
             the length in terms of number of digits of the counter (with \
             leading zeros).")
+        # Add the argument "--no-shell" to execute commands directly:
+        self.add_argument("--no-shell", action="store_true", \
+            help="execute the commands directly instead of via the shell. \
+            The command is split into arguments like in the shell, and the \
+            placeholders are replaced in each argument. Shell features such \
+            as pipes and redirections are not available.")
         # Add the argument "-r" to search recursively:
         self.add_argument("-r", "--recursive", action="store_true", \
             help="search for files recursively under the provided path.")
+        # Add the arguments for the result cache:
+        self.add_argument("--result-cache", metavar="DIR", help="store the \
+            output and return code of each command in the given directory, \
+            keyed by the command and the content of the input file, and \
+            replay them instead of executing the command again for a file \
+            with the same content. This is only correct for commands whose \
+            result depends on nothing but the file content. The output is \
+            grouped (see -g). The counter cannot be used.")
+        self.add_argument("--result-cache-size", type=check_negative, \
+            default=mc.RESULT_CACHE_SIZE_MB, metavar="MB", help="keep at \
+            most the given number of megabytes in the result cache. The \
+            results that were used least recently are evicted first.")
+        self.add_argument("--cache-output", action="append", \
+            metavar="TEMPLATE", help="store the output file given by the \
+            template, which may contain placeholders, along with each result \
+            in the result cache, and restore it when the result is \
+            replayed. This option can be given multiple times.")
+        # Add the argument "--schedule" to set the order of dispatching:
+        self.add_argument("--schedule", choices=mc.SCHEDULES, \
+            default=mc.SCHEDULE_SORTED, help="set the order in which the \
+            commands are started. With '" + mc.SCHEDULE_LARGEST_FIRST + "', \
+            the commands for the largest files are started first, which \
+            shortens parallel runs. The counter values do not change.")
+        # Add the arguments for sharding the input across several hosts:
+        self.add_argument("--shard", type=check_shard, metavar="INDEX/COUNT", \
+            help="split the input into COUNT disjoint shards by a stable hash \
+            of the paths and only process the shard INDEX (0 to COUNT-1). \
+            The counter values are the same as without sharding.")
+        self.add_argument("--shard-directories", action="store_true", \
+            help="assign whole directory trees instead of single files to \
+            the shards, so that only the trees of the shard are searched. \
+            The entries directly under the provided path are hashed. The \
+            counter cannot be used in this case.")
+        # Add the argument "-s" to stream the input:
+        self.add_argument("-s", "--stream", action="store_true", \
+            help="start executing commands while the input is still being \
+            collected. The input is processed in the order in which it is \
+            found instead of being sorted.")
+        # Add the argument "--walk-threads" to read directories concurrently:
+        self.add_argument("--walk-threads", type=check_negative, default=1, \
+            metavar="N", help="read up to N directories concurrently when \
+            searching recursively. The value 0 uses one thread per available \
+            core.")
+        # Add the argument "--stats" to print statistics:
+        self.add_argument("--stats", action="store_true", help="print \
+            statistics at the end, including the time spent in each stage, \
+            the latency percentiles of the commands, and the slowest files.")
+        # Add the argument "--timeout" to limit the duration of each command:
+        self.add_argument("--timeout", type=check_negative_float, \
+            default=0.0, metavar="SECONDS", help="kill a command, including \
+            all processes it has started, if it runs for more than the \
+            given number of seconds. A command that times out counts as an \
+            error. The value 0 disables the timeout.")
+        # Add the argument "--watch" to process new and changed files:
+        self.add_argument("--watch", action="store_true", help="keep running \
+            after the input has been processed and apply the command to \
+            files (or directories) that are created or modified under the \
+            provided paths, until map is interrupted. Changes are detected \
+            with inotify if it is available and by searching the paths \
+            again every few seconds otherwise.")
+        # Add the argument "--watch-delay" to debounce changes:
+        self.add_argument("--watch-delay", type=check_negative_float, \
+            default=mc.WATCH_DELAY, metavar="SECONDS", help="with --watch, \
+            process a changed entry only once it has not changed for the \
+            given number of seconds, so that files that are still being \
+            written are not processed. The default is 1 second.")
+        # Add the argument "--worker" to process the files with coprocesses:
+        self.add_argument("--worker", metavar="COMMAND", help="start the \
+            given command once per job and send it a request for each file \
+            instead of executing the command for each file. The request is \
+            the command with the placeholders replaced, without quotes, \
+            followed by a newline. The worker must answer each request with \
+            a line on its standard output that starts with the return code, \
+            i.e., 0 if the file was processed successfully.")
         # Add the argument "-v" for verbose output:
         self.add_argument("-v", "--verbose", action="store_true", \
             help="display detailed information about the process.")
         # Add the argument "-V" to print the version:
-        self.add_argument("-V", '--version', action='version', version='map '+ \
-            version +'\n'+version_text, help="display information about the \
-            installed version.")
+        # The version information is only read if it is requested:
+        self.add_argument("-V", '--version', action=MapVersionAction, \
+            help="display information about the installed version.")
         # Add the mandatory command argument:
         self.add_argument("command", help="The command that is applied to all \
             matching files/directories.")
@@ -95,15 +248,39 @@ class MapArgumentParser(ArgumentParser):
         """ The help statement is slightly changed in that
         1) map_constants.placeholderCounterHelpVersion is replaced by
         map_constants.PLACEHOLDER_COUNTER
-        2) 'COUNT_FROM', 'NUMBER_LENGTH', and 'EXTENSIONS' are shortened to
-        'VALUE', 'LENGTH', and 'EXT', respectively.
+        2) 'COUNT_FROM', 'NUMBER_LENGTH', 'JOBS', and 'EXTENSIONS' are
+        shortened to 'VALUE', 'LENGTH', 'N', and 'EXT', respectively.
         @return: The formatted help text
         """
+        if self.description is None:
+            self.description = get_description()
         return super(MapArgumentParser, self).format_help().replace(
             mc.PLACEHOLDER_COUNTER_HELP_TEXT,
             mc.PLACEHOLDER_COUNTER).replace('COUNT_FROM', \
-            'VALUE').replace('NUMBER_LENGTH', 'LENGTH').replace('EXTENSIONS', \
-            'EXT')
+            'VALUE').replace('NUMBER_LENGTH', 'LENGTH').replace('JOBS', \
+            'N').replace('EXTENSIONS', 'EXT')
+
+
+class MapVersionAction(argparse.Action):
+    """ MapVersionAction prints the version information and exits. Unlike
+    the standard 'version' action, it reads the version information only when
+    the option is given, which keeps the startup of map short.
+    """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help=None):
+        """ The constructor creates a MapVersionAction object."""
+        super(MapVersionAction, self).__init__(
+            option_strings=option_strings, dest=dest, default=default,
+            nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        """ The method prints the version information and exits."""
+        info = get_version_info()
+        sys.stdout.write('map ' + info['__version__'] + '\n' +
+                         info['__version_text__'] + '\n')
+        parser.exit()
+
 
 def check_negative(value):
     """ The method checks if the provided value is negative.
@@ -124,6 +301,64 @@ def check_negative(value):
     return int_value
 
 
+def check_negative_float(value):
+    """ The method checks if the provided value is a negative number.
+    @param value: The input value in the form of a string
+    @return: The float value of the input
+    """
+    error_message = value + " is invalid because only non-negative " \
+        "numbers are allowed."
+    try:
+        float_value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(error_message)
+    if not float_value >= 0:
+        raise argparse.ArgumentTypeError(error_message)
+    return float_value
+
+
+def check_shard(value):
+    """ The method checks if the provided value is a valid shard.
+    @param value: The input value in the form 'INDEX/COUNT'
+    @return: The tuple (index, count)
+    """
+    error_message = value + " is invalid because the shard must be " \
+        "given as INDEX/COUNT with 0 <= INDEX < COUNT."
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(error_message)
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(error_message)
+    return index, count
+
+
+def get_description():
+    """ The method returns the description of map in the help text.
+    @return: The description
+    """
+    return "The given command is applied to all " \
+    "files/directories under the provided path.\nThe command must be set " \
+    "in quotation marks.\n\nplaceholders:\n"+mc.PLACEHOLDER+ \
+    " is used as the placeholder for the current matching file including " \
+    "the full path.\n"+mc.PLACEHOLDER_FILENAME+" is used as the " \
+    "placeholder for the current file's name without its path or " \
+    "extension.\n"+mc.PLACEHOLDER_PATH+" is used as the " \
+    "placeholder for the current file's path.\n"+ \
+    mc.PLACEHOLDER_EXTENSION+" is used as the placeholder for " \
+    "the current file's extension including the dot.\n" + \
+    mc.PLACEHOLDER_COUNTER_HELP_TEXT+" is used to refer to " \
+    "an internal counter, incremented after each command.\n\n" \
+    "Examples:\n  map \"mv " + mc.PLACEHOLDER + " " + \
+    mc.PLACEHOLDER_PATH + mc.PLACEHOLDER_FILENAME + \
+    mc.PLACEHOLDER_COUNTER_HELP_TEXT + \
+    mc.PLACEHOLDER_EXTENSION + "\" /path/to/folder: A counter " \
+    "is added to all file names.\n  map -r \"mv "+ \
+    mc.PLACEHOLDER + " " + mc.PLACEHOLDER_PATH + \
+    "/..\" /path/to/folder: Each file is moved to its respective " \
+    "parent directory."
+
+
 def get_version_info():
     """ The method returns the version information.
     @return: The dictionary containing the version information
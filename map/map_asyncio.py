@@ -0,0 +1,106 @@
+"""
+map_asyncio executes the commands of a map run as subprocesses of an
+asyncio event loop (--engine asyncio). It is only imported if this engine
+is used.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import time
+import asyncio
+from map.mapper import kill_process_group
+
+
+class MapAsyncioEngine(object):
+    """
+    MapAsyncioEngine executes commands as subprocesses of an asyncio event
+    loop, which waits for all of them in a single thread. The loop only
+    runs while the engine waits for commands.
+    """
+
+    def __init__(self, executor, args):
+        """
+        The constructor creates the event loop.
+        @param executor: The MapExecutor that executes the commands
+        @param args: The parsed map arguments
+        """
+        self.executor = executor
+        self.args = args
+        self.loop = asyncio.new_event_loop()
+
+    def submit(self, command):
+        """
+        This method starts the execution of a command.
+        @param command: The command
+        @return: The task of the MapCommandResult
+        """
+        return self.loop.create_task(
+            execute_command(self.executor, command, self.args))
+
+    def wait(self, running, timeout=None):
+        """
+        This method runs the event loop until at least one of the commands
+        has finished or the timeout has expired.
+        @param running: The tasks of the running commands
+        @param timeout: The maximum number of seconds to wait, or None
+        @return: The set of tasks whose commands have finished
+        """
+        done, _ = self.loop.run_until_complete(asyncio.wait(
+            list(running), timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED))
+        return done
+
+    def close(self, running):
+        """
+        This method kills the commands that are still running, which is
+        only the case if the results are not consumed completely, and closes
+        the event loop.
+        @param running: The tasks of the running commands
+        """
+        if running:
+            for task in running:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(
+                *running, return_exceptions=True))
+        self.loop.close()
+
+
+async def execute_command(executor, command, args):
+    """
+    The method is the asyncio counterpart of MapExecutor.execute_command().
+    The command is executed as a subprocess of the event loop, so that many
+    commands can be awaited by a single thread. If the task is cancelled,
+    the command is killed.
+    @param executor: The MapExecutor that executes the commands
+    @param command: The command to be executed
+    @param args: The parsed map arguments
+    @return: The MapCommandResult
+    """
+    output, error_output = executor.open_output(args)
+    start = time.time()
+    timed_out = False
+    try:
+        if isinstance(command, list):
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=output, stderr=error_output,
+                start_new_session=True)
+        else:
+            process = await asyncio.create_subprocess_shell(
+                command, stdout=output, stderr=error_output,
+                start_new_session=True)
+    except OSError as error:
+        return_code = executor.report_start_error(error, error_output)
+    else:
+        try:
+            return_code = await asyncio.wait_for(
+                process.wait(), args.timeout if args.timeout > 0 else None)
+        except asyncio.TimeoutError:
+            kill_process_group(process.pid)
+            return_code = await process.wait()
+            timed_out = True
+        except asyncio.CancelledError:
+            kill_process_group(process.pid)
+            await process.wait()
+            raise
+    return executor.make_result(return_code, output, error_output, start,
+                                timed_out=timed_out)
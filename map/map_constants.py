@@ -25,3 +25,88 @@ ESCAPE_CHARACTER = '\\'
 # extensions:
 
 PLACEHOLDER_NO_EXTENSION_FILTER = '^'
+
+# The following values are used to limit the size of the argument list when
+# commands are built for batches of files. The default applies if ARG_MAX
+# cannot be determined:
+
+DEFAULT_ARG_MAX = 131072
+ARG_MAX_HEADROOM = 2048
+
+# On Linux, a single argument cannot be longer than MAX_ARG_STRLEN, which
+# limits the length of a command that is passed to the shell:
+
+MAX_ARG_STRLEN = 131072
+
+# The number of bytes that are read at once when the input paths are read
+# from a file:
+
+PATH_LIST_CHUNK_SIZE = 65536
+
+# The number of records that are written to the journal at once:
+
+JOURNAL_FLUSH_INTERVAL = 100
+
+# The maximum total number of entries in the listing cache, and the minimum
+# age in seconds of a directory's modification time for its listing to be
+# cached. Changes made within the same clock tick as the last modification
+# might otherwise go unnoticed:
+
+LISTING_CACHE_SIZE = 10000000
+LISTING_CACHE_MIN_AGE = 2.0
+
+# The number of slowest commands that are listed in the statistics:
+
+STATS_SLOWEST = 10
+
+# The schedules that determine the order in which jobs are dispatched:
+
+SCHEDULE_SORTED = 'sorted'
+SCHEDULE_LARGEST_FIRST = 'largest-first'
+SCHEDULES = [SCHEDULE_SORTED, SCHEDULE_LARGEST_FIRST]
+
+# The engines that execute the commands:
+
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNCIO = 'asyncio'
+ENGINES = [ENGINE_THREADS, ENGINE_ASYNCIO]
+
+# The parameters of the adaptive concurrency (--adaptive): the number of
+# seconds between two adjustments, the default maximum number of jobs per
+# core, the thresholds of the load average per core and of the pressure
+# stall information in percent above which the system is overloaded and
+# below which it has spare capacity, the factor by which the number of jobs
+# is reduced under overload, and the share of the previous throughput below
+# which an increase is undone:
+
+ADAPTIVE_INTERVAL = 1.0
+ADAPTIVE_MAX_JOBS_PER_CORE = 2
+ADAPTIVE_LOAD_HIGH = 1.0
+ADAPTIVE_LOAD_LOW = 0.8
+ADAPTIVE_PRESSURE_HIGH = 20.0
+ADAPTIVE_MEMORY_PRESSURE_HIGH = 5.0
+ADAPTIVE_PRESSURE_LOW = 5.0
+ADAPTIVE_DECREASE = 0.75
+ADAPTIVE_THROUGHPUT_TOLERANCE = 0.9
+
+# The parameters of the watch mode (--watch): the default number of seconds
+# that a changed entry must remain unchanged before it is processed, the
+# number of seconds between two searches if inotify is not available, the
+# number of bytes of inotify events that are read at once, and the number of
+# processed entries whose state is remembered:
+
+WATCH_DELAY = 1.0
+WATCH_POLL_INTERVAL = 2.0
+WATCH_BUFFER_SIZE = 65536
+WATCH_HISTORY_SIZE = 100000
+
+# The parameters of the result cache (--result-cache): the default maximum
+# size of the cache in megabytes, the number of bytes of an input file that
+# are hashed at once, the number of jobs per hashing thread whose input is
+# hashed in advance, and the return codes whose results are not cached
+# because the command could not be run:
+
+RESULT_CACHE_SIZE_MB = 1024
+RESULT_CACHE_CHUNK_SIZE = 1048576
+RESULT_CACHE_LOOKAHEAD = 4
+RESULT_CACHE_UNCACHED_CODES = (126, 127)
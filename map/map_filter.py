@@ -0,0 +1,129 @@
+"""
+MapPathFilter decides which entries map considers while it searches for
+its input, based on exclude and include patterns and the maximum depth.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import os
+import re
+import fnmatch
+
+
+class MapPathFilter(object):
+    """
+    MapPathFilter matches paths against exclude and include patterns, which
+    are compiled once. Glob patterns without a slash are matched against the
+    name of an entry, and glob patterns with a slash against its path
+    relative to the provided directory. Regular expressions are searched in
+    the relative path.
+    Excluded entries are never considered, and excluded directories are not
+    searched. If there are include patterns, only matching entries are part
+    of the input, but all directories are still searched.
+    """
+
+    def __init__(self, exclude=None, include=None, regex=False, max_depth=0):
+        """
+        The constructor compiles the patterns. A ValueError is raised if a
+        regular expression is invalid.
+        @param exclude: List of patterns of excluded entries, or None
+        @param include: List of patterns of included entries, or None
+        @param regex: If True, the patterns are regular expressions instead
+            of glob patterns
+        @param max_depth: The maximum depth of the entries below the provided
+            directory, where 1 stands for the entries of the directory
+            itself, or 0 for no limit
+        """
+        self.regex = regex
+        self.exclude = self.compile_patterns(exclude or [])
+        self.include = self.compile_patterns(include or [])
+        self.has_include = bool(include)
+        self.max_depth = max_depth
+
+    def compile_patterns(self, patterns):
+        """
+        This method compiles a list of patterns into at most two regular
+        expressions, one for the names and one for the relative paths.
+        @param patterns: The list of patterns
+        @return: Tuple of the compiled expressions for the names and for
+            the relative paths, each of which is None if there is no
+            pattern of its kind
+        """
+        if self.regex:
+            name_patterns = []
+            path_patterns = patterns
+        else:
+            name_patterns = [fnmatch.translate(pattern)
+                             for pattern in patterns if '/' not in pattern]
+            path_patterns = [fnmatch.translate(pattern.strip('/'))
+                             for pattern in patterns if '/' in pattern]
+        try:
+            return (combine_patterns(name_patterns),
+                    combine_patterns(path_patterns))
+        except re.error as error:
+            raise ValueError('invalid pattern: ' + str(error))
+
+    def matches(self, patterns, path, root):
+        """
+        This method checks whether a path matches any of the given compiled
+        patterns.
+        @param patterns: The compiled patterns as returned by
+            compile_patterns()
+        @param path: The path
+        @param root: The provided directory that contains the path, or ''
+        @return: True if the path matches
+        """
+        name_pattern, path_pattern = patterns
+        if name_pattern is not None and \
+                name_pattern.match(os.path.basename(path)):
+            return True
+        if path_pattern is not None:
+            relative_path = path[len(root):].lstrip('/') \
+                if path.startswith(root) else path
+            if self.regex:
+                return path_pattern.search(relative_path) is not None
+            return path_pattern.match(relative_path) is not None
+        return False
+
+    def is_excluded(self, path, root):
+        """
+        This method checks whether an entry is excluded.
+        @param path: The path of the entry
+        @param root: The provided directory that contains the entry, or ''
+        @return: True if the entry is excluded
+        """
+        return self.matches(self.exclude, path, root)
+
+    def is_included(self, path, root):
+        """
+        This method checks whether an entry is part of the input according
+        to the include patterns.
+        @param path: The path of the entry
+        @param root: The provided directory that contains the entry, or ''
+        @return: True if there are no include patterns or the entry matches
+        """
+        return not self.has_include or self.matches(self.include, path, root)
+
+    def allows_descent(self, depth):
+        """
+        This method checks whether the subdirectories at the given depth are
+        searched.
+        @param depth: The depth of the subdirectories, where 1 stands for
+            the subdirectories of the provided directory
+        @return: True if the entries of the subdirectories are within the
+            maximum depth
+        """
+        return self.max_depth == 0 or depth < self.max_depth
+
+
+def combine_patterns(patterns):
+    """
+    The method combines regular expressions into a single compiled
+    expression that matches if any of them matches.
+    @param patterns: List of regular expressions
+    @return: The compiled expression, or None if the list is empty
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(['(?:' + pattern + ')'
+                                for pattern in patterns]))
@@ -0,0 +1,115 @@
+"""
+MapJournal records which files map has processed successfully.
+It allows map to resume an interrupted run without processing the same
+files again.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import os
+import json
+from map import map_constants as mc
+
+
+class MapJournal(object):
+    """
+    MapJournal keeps track of the successfully processed files in a journal
+    file. Each line of the journal is a JSON object containing the path, the
+    size and modification time of the file after the command completed, and
+    the command that was executed for the file.
+    A file is complete if its path, size, modification time, and command
+    match the most recent record. The journal is only ever appended to, and
+    records are written in batches.
+    """
+
+    def __init__(self, filename, flush_interval=mc.JOURNAL_FLUSH_INTERVAL):
+        """
+        The constructor loads the existing records and opens the journal
+        for appending. An IOError is raised if the journal cannot be opened.
+        @param filename: The path to the journal file
+        @param flush_interval: The number of records that are written at once
+        """
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.records = {}
+        self.pending = []
+        self.load()
+        self.journal_file = open(filename, 'a')
+
+    def load(self):
+        """
+        This method reads all records of the journal. Lines that cannot be
+        parsed, e.g., because map was terminated while writing them, are
+        ignored.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                    self.records[record['path']] = (
+                        record['size'], record['mtime'], record['command'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    def is_complete(self, path, size, mtime, command):
+        """
+        This method checks whether the file has already been processed with
+        the given command and has not changed since.
+        @param path: The path to the file
+        @param size: The size of the file or None if it is unknown
+        @param mtime: The modification time of the file or None if it is
+            unknown
+        @param command: The command for the file
+        @return: True if the file does not need to be processed again
+        """
+        record = self.records.get(path)
+        if record is None:
+            return False
+        if size is None or mtime is None:
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                return False
+            size = stat_result.st_size
+            mtime = stat_result.st_mtime
+        return record == (size, mtime, command)
+
+    def record(self, path, command):
+        """
+        This method records that the file has been processed successfully.
+        The size and modification time are determined now so that changes
+        made by the command itself do not cause the file to be processed
+        again. Files that no longer exist are not recorded.
+        @param path: The path to the file
+        @param command: The command that was executed for the file
+        """
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return
+        self.records[path] = (stat_result.st_size, stat_result.st_mtime,
+                              command)
+        self.pending.append(json.dumps(
+            {'path': path, 'size': stat_result.st_size,
+             'mtime': stat_result.st_mtime, 'command': command}))
+        if len(self.pending) >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        This method appends all pending records to the journal file.
+        """
+        if self.pending:
+            self.journal_file.write('\n'.join(self.pending) + '\n')
+            self.journal_file.flush()
+            self.pending = []
+
+    def close(self):
+        """
+        This method writes the pending records and closes the journal file.
+        """
+        self.flush()
+        os.fsync(self.journal_file.fileno())
+        self.journal_file.close()
@@ -0,0 +1,138 @@
+"""
+MapListingCache stores directory listings on disk so that directories that
+have not changed since the last run do not have to be read again.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import os
+import json
+import time
+import threading
+from map import map_constants as mc
+
+# The flags that encode the file type of a cached entry:
+FLAG_DIR = 1
+FLAG_FILE = 2
+FLAG_SYMLINK = 4
+
+
+class MapListingCache(object):
+    """
+    MapListingCache maps directories to their listings. A listing is valid as
+    long as the device, inode number, and modification time of the directory
+    are unchanged, which is the case unless entries were added, removed, or
+    renamed. Only the names and file types of the entries are cached.
+    The cache is loaded from and saved to a JSON file. If the total number
+    of cached entries exceeds the maximum size, the listings that were used
+    least recently are evicted when the cache is saved.
+    """
+
+    def __init__(self, filename, max_size=mc.LISTING_CACHE_SIZE,
+                 refresh=False):
+        """
+        The constructor loads the cache file unless the cache is refreshed.
+        @param filename: The path to the cache file
+        @param max_size: The maximum total number of cached entries
+        @param refresh: If True, the existing listings are not used
+        """
+        self.filename = filename
+        self.max_size = max_size
+        self.listings = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # The listings used in this run get the current time as their
+        # last use:
+        self.now = time.time()
+        if not refresh:
+            self.load()
+
+    def load(self):
+        """
+        This method reads the cache file. A missing or corrupt cache file
+        results in an empty cache.
+        """
+        try:
+            with open(self.filename) as cache_file:
+                listings = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return
+        if isinstance(listings, dict):
+            self.listings = listings
+
+    def get_key(self, path):
+        """
+        This method returns the key of a directory in the cache.
+        @param path: The directory
+        @return: The absolute path of the directory
+        """
+        return os.path.abspath(path)
+
+    def get(self, path, stat_result):
+        """
+        This method returns the cached listing of a directory if the
+        directory has not changed.
+        @param path: The directory
+        @param stat_result: The current os.stat result of the directory
+        @return: List of (name, flags) pairs, or None if there is no valid
+            listing
+        """
+        key = self.get_key(path)
+        listing = self.listings.get(key)
+        with self.lock:
+            if listing is None or listing[:3] != [
+                    stat_result.st_dev, stat_result.st_ino,
+                    stat_result.st_mtime_ns]:
+                self.misses += 1
+                return None
+            self.hits += 1
+            listing[3] = self.now
+        return listing[4]
+
+    def put(self, path, stat_result, entries):
+        """
+        This method stores the listing of a directory. Listings of
+        directories that were modified very recently are not stored because
+        further changes might not alter the modification time.
+        @param path: The directory
+        @param stat_result: The os.stat result of the directory taken before
+            it was read
+        @param entries: The MapEntry objects of the directory
+        """
+        if self.now - stat_result.st_mtime < mc.LISTING_CACHE_MIN_AGE:
+            return
+        names = []
+        for entry in entries:
+            flags = (FLAG_DIR if entry.is_dir else 0) | \
+                (FLAG_FILE if entry.is_file else 0) | \
+                (FLAG_SYMLINK if entry.is_symlink else 0)
+            names.append([os.path.basename(entry.path), flags])
+        self.listings[self.get_key(path)] = [
+            stat_result.st_dev, stat_result.st_ino, stat_result.st_mtime_ns,
+            self.now, names]
+
+    def evict(self):
+        """
+        This method removes the least recently used listings until the total
+        number of cached entries does not exceed the maximum size.
+        """
+        size = sum([len(listing[4]) for listing in self.listings.values()])
+        if size <= self.max_size:
+            return
+        for key in sorted(self.listings,
+                          key=lambda key: self.listings[key][3]):
+            size -= len(self.listings.pop(key)[4])
+            if size <= self.max_size:
+                break
+
+    def save(self):
+        """
+        This method writes the cache file. The file is replaced atomically
+        so that an interrupted run does not corrupt the cache.
+        """
+        self.evict()
+        temporary_filename = self.filename + '.tmp'
+        with open(temporary_filename, 'w') as cache_file:
+            json.dump(self.listings, cache_file, separators=(',', ':'))
+        os.replace(temporary_filename, self.filename)
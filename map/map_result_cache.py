@@ -0,0 +1,295 @@
+"""
+MapResultCache stores the results of commands keyed by the command and the
+content of the input file, so that commands that are pure functions of the
+file content are not executed again for identical files.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import collections
+from concurrent import futures
+from map import map_constants as mc
+
+# The name of the index file in the cache directory:
+INDEX_FILENAME = 'index.json'
+
+# A MapCachedResult is a result found in the cache: the return code, the
+# duration of the original command, and the files in the cache that contain
+# the output, the error output, and the declared output files:
+MapCachedResult = collections.namedtuple(
+    'MapCachedResult', ['return_code', 'duration', 'output', 'error_output',
+                        'output_files'])
+
+
+class MapResultCache(object):
+    """
+    MapResultCache keeps the results of commands in a directory. Each entry
+    is a subdirectory named after its key, the hash of the command template
+    and the content of the input file, and contains
+
+        result.json     the return code and the duration of the command,
+        stdout/stderr   the output and error output, and
+        output<N>       the declared output files.
+
+    Entries are written to a temporary directory first and renamed, so that
+    an interrupted run does not leave incomplete entries. The size and last
+    use of each entry are kept in an index file. When the cache is closed,
+    the least recently used entries are evicted until the total size does
+    not exceed the maximum size.
+    The input files are hashed by a pool of threads ahead of the execution:
+
+        prefetch(jobs)          yields the jobs while hashing ahead,
+        lookup(job)             returns the cached result or None, and
+        store(job, result)      stores the result of an executed job.
+    """
+
+    def __init__(self, directory, template, output_templates=None,
+                 max_size=mc.RESULT_CACHE_SIZE_MB * 1048576, threads=None):
+        """
+        The constructor creates the cache directory if necessary and loads
+        the index. An OSError is raised if the directory cannot be created.
+        @param directory: The cache directory
+        @param template: The compiled MapCommandTemplate of the command
+        @param output_templates: The compiled MapCommandTemplate objects of
+            the output files that are stored along with the result, or None
+        @param max_size: The maximum total size of the entries in bytes
+        @param threads: The number of threads that hash the input files, by
+            default one per available core
+        """
+        self.directory = directory
+        self.template = template
+        self.output_templates = output_templates or []
+        self.max_size = max_size
+        self.threads = threads or os.cpu_count() or 1
+        os.makedirs(directory, exist_ok=True)
+        # The command and the output files determine the result, so they are
+        # part of every key:
+        self.command_digest = hashlib.sha256(json.dumps(
+            [template.command, template.number_length, template.shell,
+             [output.command for output in self.output_templates]]).encode(
+                 'utf-8')).hexdigest()
+        self.index = {}
+        self.load()
+        self.now = time.time()
+        # The keys of the jobs that are being looked up or executed:
+        self.keys = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+
+    def load(self):
+        """
+        This method reads the index. A missing or corrupt index is rebuilt
+        from the entries in the cache directory.
+        """
+        try:
+            with open(os.path.join(self.directory, INDEX_FILENAME)) as \
+                    index_file:
+                index = json.load(index_file)
+            if isinstance(index, dict):
+                self.index = index
+                return
+        except (IOError, OSError, ValueError):
+            pass
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != INDEX_FILENAME and not name.startswith('.') and \
+                    os.path.isdir(path):
+                self.index[name] = [get_size(path),
+                                    os.stat(path).st_mtime]
+
+    def get_key(self, filename):
+        """
+        This method computes the key of the result for an input file.
+        @param filename: The input file
+        @return: The key, or None if the file cannot be read
+        """
+        content_hash = hashlib.sha256()
+        try:
+            with open(filename, 'rb') as input_file:
+                while True:
+                    chunk = input_file.read(mc.RESULT_CACHE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    content_hash.update(chunk)
+        except (IOError, OSError):
+            return None
+        return hashlib.sha256((self.command_digest + content_hash.hexdigest())
+                              .encode('utf-8')).hexdigest()
+
+    def prefetch(self, jobs):
+        """
+        This method returns a generator that yields the jobs while the input
+        files of the upcoming jobs are hashed in parallel. Only a limited
+        number of jobs are taken from the iterable in advance.
+        @param jobs: Iterable of MapJob objects with a single file each
+        @return: Generator of MapJob objects
+        """
+        window = collections.deque()
+        with futures.ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for job in jobs:
+                self.keys[id(job)] = pool.submit(self.get_key, job.files[0])
+                window.append(job)
+                if len(window) > self.threads * mc.RESULT_CACHE_LOOKAHEAD:
+                    yield window.popleft()
+            while window:
+                yield window.popleft()
+
+    def get_output_files(self, job):
+        """
+        This method returns the declared output files of a job.
+        @param job: The MapJob
+        @return: List of paths
+        """
+        return [output.build_request(job.files[0], job.counts[0])
+                for output in self.output_templates]
+
+    def lookup(self, job):
+        """
+        This method looks up the result of a job. On a hit, the declared
+        output files are restored.
+        @param job: The MapJob
+        @return: The MapCachedResult, or None if the result is not cached
+        """
+        key = self.keys.pop(id(job), None)
+        if isinstance(key, futures.Future):
+            key = key.result()
+        elif key is None:
+            key = self.get_key(job.files[0])
+        if key is None:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, 'result.json')) as result_file:
+                record = json.load(result_file)
+            return_code = int(record['return_code'])
+            duration = float(record['duration'])
+            output_files = [os.path.join(path, 'output' + str(index))
+                            for index in range(len(self.output_templates))]
+            for source, target in zip(output_files,
+                                      self.get_output_files(job)):
+                restore_file(source, target)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            # The key is kept so that the result can be stored:
+            self.misses += 1
+            self.keys[id(job)] = key
+            return None
+        self.hits += 1
+        self.saved_time += duration
+        if key not in self.index:
+            self.index[key] = [get_size(path), self.now]
+        self.index[key][1] = self.now
+        return MapCachedResult(return_code, duration,
+                               os.path.join(path, 'stdout'),
+                               os.path.join(path, 'stderr'), output_files)
+
+    def store(self, job, result):
+        """
+        This method stores the result of an executed job, together with
+        its declared output files. Results of commands that timed out, were
+        killed, or could not be started are not stored, and neither are
+        results whose output files are missing.
+        @param job: The executed MapJob
+        @param result: The MapCommandResult, whose output must be spooled
+        """
+        key = self.keys.pop(id(job), None)
+        if key is None or result.timed_out or result.output is None or \
+                result.return_code < 0 or \
+                result.return_code in mc.RESULT_CACHE_UNCACHED_CODES:
+            return
+        output_files = self.get_output_files(job)
+        if not all(os.path.isfile(path) for path in output_files):
+            return
+        try:
+            temporary_path = tempfile.mkdtemp(prefix='.', dir=self.directory)
+        except OSError:
+            return
+        try:
+            for name, spooled_output in (('stdout', result.output),
+                                         ('stderr', result.error_output)):
+                spooled_output.seek(0)
+                with open(os.path.join(temporary_path, name), 'wb') as \
+                        target:
+                    shutil.copyfileobj(spooled_output, target)
+            for index, path in enumerate(output_files):
+                shutil.copyfile(path, os.path.join(temporary_path,
+                                                   'output' + str(index)))
+            with open(os.path.join(temporary_path, 'result.json'), 'w') as \
+                    result_file:
+                json.dump({'return_code': result.return_code,
+                           'duration': result.duration}, result_file)
+            size = get_size(temporary_path)
+            os.rename(temporary_path, os.path.join(self.directory, key))
+        except (IOError, OSError):
+            # Another run may have stored the same result in the meantime:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            return
+        self.index[key] = [size, self.now]
+
+    def evict(self):
+        """
+        This method removes the least recently used entries until the total
+        size does not exceed the maximum size.
+        """
+        size = sum([entry[0] for entry in self.index.values()])
+        if size <= self.max_size:
+            return
+        for key in sorted(self.index, key=lambda key: self.index[key][1]):
+            size -= self.index.pop(key)[0]
+            shutil.rmtree(os.path.join(self.directory, key),
+                          ignore_errors=True)
+            if size <= self.max_size:
+                break
+
+    def close(self):
+        """
+        This method evicts entries if the cache is too large and writes the
+        index. The index is replaced atomically.
+        """
+        self.evict()
+        index_filename = os.path.join(self.directory, INDEX_FILENAME)
+        with open(index_filename + '.tmp', 'w') as index_file:
+            json.dump(self.index, index_file, separators=(',', ':'))
+        os.replace(index_filename + '.tmp', index_filename)
+
+    def get_summary(self):
+        """
+        This method describes the use of the cache in this run.
+        @return: The summary as a string
+        """
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups > 0 else 0.0
+        return 'Result cache: ' + str(self.hits) + ' hit(s), ' + \
+            str(self.misses) + ' miss(es) (' + '{0:.1f}'.format(rate) + \
+            '% hit rate), ' + '{0:.3f}'.format(self.saved_time) + \
+            ' seconds saved.'
+
+
+def get_size(path):
+    """
+    The method returns the total size of the files in a cache entry.
+    @param path: The directory of the entry
+    @return: The size in bytes
+    """
+    size = 0
+    for name in os.listdir(path):
+        size += os.path.getsize(os.path.join(path, name))
+    return size
+
+
+def restore_file(source, target):
+    """
+    The method restores an output file from the cache. The file is copied
+    next to the target and renamed so that the target is never incomplete.
+    @param source: The file in the cache
+    @param target: The path of the output file
+    """
+    temporary_filename = target + '.map-tmp'
+    shutil.copyfile(source, temporary_filename)
+    os.replace(temporary_filename, target)
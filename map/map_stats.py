@@ -0,0 +1,218 @@
+"""
+MapStatistics collects timing information about a map run.
+It records the duration of the stages of the run and of each command, and
+it can write the records as a stream of JSON events.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import sys
+import json
+import time
+import heapq
+import array
+from map import map_constants as mc
+
+
+class MapStatistics(object):
+    """
+    MapStatistics records the stage timings and the per-command results
+    of a map run. At the end of the run,
+
+        get_summary()
+
+    computes the latency percentiles, the slowest files, and the throughput.
+    If an event file is given, every record is also written to it as a
+    single line of JSON as soon as it is available so that long runs can be
+    monitored.
+    """
+
+    def __init__(self, events_filename=None, slowest=mc.STATS_SLOWEST):
+        """
+        The constructor creates a MapStatistics object.
+        An IOError is raised if the event file cannot be opened.
+        @param events_filename: The file that the events are written to,
+            '-' for the standard error, or None
+        @param slowest: The number of slowest commands in the summary
+        """
+        self.start_time = time.time()
+        self.stages = {}
+        self.durations = array.array('d')
+        self.slowest = []
+        self.num_slowest = slowest
+        self.num_files = 0
+        self.num_errors = 0
+        self.output_bytes = 0
+        self.events_file = None
+        if events_filename == '-':
+            self.events_file = sys.stderr
+        elif events_filename is not None:
+            self.events_file = open(events_filename, 'a')
+
+    def write_event(self, event_type, data):
+        """
+        This method writes an event to the event file, if there is one.
+        @param event_type: The type of the event
+        @param data: Dictionary with the data of the event
+        """
+        if self.events_file is None:
+            return
+        event = {'event': event_type, 'time': time.time()}
+        event.update(data)
+        self.events_file.write(json.dumps(event) + '\n')
+        self.events_file.flush()
+
+    def add_stage_time(self, stage, seconds):
+        """
+        This method adds time to a stage.
+        @param stage: The name of the stage
+        @param seconds: The time spent in the stage
+        """
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def timed(self, iterable, stage, nested_stage=None):
+        """
+        This method returns a generator that yields the items of the given
+        iterable and adds the time spent producing them to a stage. If the
+        iterable consumes another timed iterable, the time of the nested
+        stage is subtracted.
+        @param iterable: The iterable
+        @param stage: The name of the stage
+        @param nested_stage: The name of the nested stage, or None
+        @return: Generator of the items
+        """
+        iterator = iter(iterable)
+        end = object()
+        while True:
+            nested_before = self.stages.get(nested_stage, 0.0)
+            start = time.time()
+            item = next(iterator, end)
+            elapsed = time.time() - start
+            self.add_stage_time(stage, elapsed - (
+                self.stages.get(nested_stage, 0.0) - nested_before))
+            if item is end:
+                return
+            yield item
+
+    def record_command(self, job, result):
+        """
+        This method records the result of a command.
+        @param job: The executed MapJob
+        @param result: The MapCommandResult of the command
+        """
+        self.durations.append(result.duration)
+        self.num_files += max(len(job.files), 1)
+        if result.return_code != 0 or result.timed_out:
+            self.num_errors += 1
+        if result.output_bytes is not None:
+            self.output_bytes += result.output_bytes
+        name = ', '.join(job.files) if job.files else str(job.command)
+        item = (result.duration, name)
+        if len(self.slowest) < self.num_slowest:
+            heapq.heappush(self.slowest, item)
+        elif self.slowest and item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+        data = {'files': job.files, 'return_code': result.return_code,
+                'timed_out': result.timed_out, 'duration': result.duration,
+                'output_bytes': result.output_bytes}
+        if result.rusage is not None:
+            data.update({'user_cpu': result.rusage.ru_utime,
+                         'system_cpu': result.rusage.ru_stime,
+                         'max_rss_kb': result.rusage.ru_maxrss})
+        self.write_event('command', data)
+
+    def get_percentile(self, sorted_values, percentile):
+        """
+        This method returns a percentile using the nearest-rank method.
+        @param sorted_values: The sorted values
+        @param percentile: The percentile between 0 and 100
+        @return: The percentile or None if there are no values
+        """
+        if not sorted_values:
+            return None
+        rank = int(len(sorted_values) * percentile / 100.0 + 0.5)
+        return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+    def get_summary(self):
+        """
+        This method computes the summary of the run.
+        @return: Dictionary with the summary
+        """
+        elapsed = time.time() - self.start_time
+        durations = sorted(self.durations)
+        return {
+            'elapsed': elapsed,
+            'stages': self.stages,
+            'commands': len(durations),
+            'files': self.num_files,
+            'errors': self.num_errors,
+            'output_bytes': self.output_bytes,
+            'commands_per_second': len(durations) / elapsed
+                                   if elapsed > 0 else 0.0,
+            'files_per_second': self.num_files / elapsed
+                                if elapsed > 0 else 0.0,
+            'latency': {'p50': self.get_percentile(durations, 50),
+                        'p95': self.get_percentile(durations, 95),
+                        'p99': self.get_percentile(durations, 99),
+                        'max': durations[-1] if durations else None},
+            'slowest': [{'duration': duration, 'file': name}
+                        for duration, name in sorted(self.slowest,
+                                                     reverse=True)]}
+
+    def finish(self, print_summary):
+        """
+        This method writes the summary event, prints the summary if
+        requested, and closes the event file.
+        @param print_summary: If True, the summary is printed
+        """
+        summary = self.get_summary()
+        self.write_event('summary', summary)
+        if self.events_file not in (None, sys.stderr):
+            self.events_file.close()
+        if print_summary:
+            print(format_summary(summary))
+
+
+def format_seconds(seconds):
+    """
+    The method formats a duration for the summary.
+    @param seconds: The duration in seconds or None
+    @return: The formatted duration
+    """
+    if seconds is None:
+        return '-'
+    return '{0:.3f}s'.format(seconds)
+
+
+def format_summary(summary):
+    """
+    The method formats the summary of a run as text.
+    @param summary: The summary as returned by MapStatistics.get_summary()
+    @return: The summary as a string
+    """
+    lines = ['Statistics:',
+             '  total time:       ' + format_seconds(summary['elapsed'])]
+    for stage in sorted(summary['stages']):
+        lines.append('  ' + (stage + ':').ljust(18) +
+                     format_seconds(summary['stages'][stage]))
+    latency = summary['latency']
+    lines.extend([
+        '  commands:         ' + str(summary['commands']) + ' (' +
+        str(summary['errors']) + ' failed)',
+        '  files:            ' + str(summary['files']),
+        '  throughput:       ' + '{0:.1f}'.format(
+            summary['files_per_second']) + ' files/s',
+        '  latency:          p50 ' + format_seconds(latency['p50']) +
+        ', p95 ' + format_seconds(latency['p95']) + ', p99 ' +
+        format_seconds(latency['p99']) + ', max ' +
+        format_seconds(latency['max'])])
+    if summary['output_bytes']:
+        lines.append('  output:           ' + str(summary['output_bytes']) +
+                     ' bytes')
+    if summary['slowest']:
+        lines.append('  slowest:')
+        for item in summary['slowest']:
+            lines.append('    ' + format_seconds(item['duration']) + '  ' +
+                         item['file'])
+    return '\n'.join(lines)
@@ -0,0 +1,414 @@
+"""
+map_watch keeps applying the command to files (or directories) that are
+created or modified under the provided paths after the initial run.
+Changes are detected with inotify on Linux and by polling elsewhere.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import signal
+import argparse
+import ctypes
+import ctypes.util
+import collections
+from map import map_constants as mc
+
+# The inotify events that map subscribes to and the flags of the events:
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# The header of an inotify event: watch descriptor, mask, cookie, and the
+# length of the name:
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class MapInotify(object):
+    """
+    MapInotify is a minimal ctypes binding of the inotify API of Linux.
+    Each watched directory is associated with its root and its depth.
+    """
+
+    def __init__(self):
+        """
+        The constructor creates an inotify instance. An OSError is raised if
+        inotify is not available.
+        """
+        library = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or library is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.watches = {}
+
+    def add_watch(self, directory, root, depth):
+        """
+        This method starts watching a directory.
+        @param directory: The directory
+        @param root: The provided directory that contains the directory
+        @param depth: The depth of the directory below the root
+        @return: True if the directory is watched
+        """
+        descriptor = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory or os.curdir), IN_WATCH_MASK)
+        if descriptor < 0:
+            return False
+        self.watches[descriptor] = (directory, root, depth)
+        return True
+
+    def read_events(self, timeout):
+        """
+        This method waits for events and returns them.
+        @param timeout: The maximum number of seconds to wait
+        @return: List of (path, is_dir, root, depth) tuples, where the depth
+            is the one of the path, or None if events were lost
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, mc.WATCH_BUFFER_SIZE)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = INOTIFY_EVENT.unpack_from(
+                data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            watch = self.watches.get(descriptor)
+            if mask & IN_IGNORED:
+                self.watches.pop(descriptor, None)
+            elif watch is not None and name:
+                directory, root, depth = watch
+                events.append((os.path.join(directory, os.fsdecode(name)),
+                               bool(mask & IN_ISDIR), root, depth + 1))
+        return events
+
+    def close(self):
+        """
+        This method closes the inotify instance.
+        """
+        os.close(self.fd)
+
+
+class MapWatcher(object):
+    """
+    MapWatcher continues a map run by waiting for changes under the provided
+    paths. An entry that was created or modified is processed once it has
+    not changed for the debounce delay, so that files that are still being
+    written are not processed prematurely. The counter continues where the
+    previous commands left off. Without inotify, the trees are searched
+    again at regular intervals.
+    The state of each processed entry is remembered (up to a limit) so that
+    entries that are modified by the command itself are not processed again.
+    """
+
+    def __init__(self, runner, use_inotify=True):
+        """
+        The constructor creates a MapWatcher object.
+        @param runner: The MapRunner of the run
+        @param use_inotify: If False, changes are detected by polling
+        """
+        self.runner = runner
+        self.args = runner.args
+        self.handler = runner.input_handler
+        self.directories = self.handler.get_directory_dictionary(self.args)
+        # The extensions of each provided directory and of -x:
+        self.patterns = dict((key, frozenset(self.directories[key].split(',')))
+                             for key in self.directories)
+        self.extensions = None
+        if self.args.extensions is not None:
+            self.extensions = frozenset(
+                self.handler.get_extension_list(self.args.extensions))
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = MapInotify()
+            except OSError:
+                self.inotify = None
+        # The state of all entries when polling, which are searched without
+        # reporting each search:
+        self.known = {}
+        self.scan_args = argparse.Namespace(**dict(vars(self.args),
+                                                   verbose=False))
+        # The time of the latest change of each entry that is not yet
+        # processed:
+        self.pending = {}
+        # The state of the processed entries after their commands finished:
+        self.processed = collections.OrderedDict()
+        # The count of the next entry and the most recent entries of the
+        # initial run:
+        self.count = self.args.count_from
+        self.initial_entries = collections.deque(
+            maxlen=mc.WATCH_HISTORY_SIZE)
+
+    def log(self, message):
+        """
+        This method prints a message in verbose mode.
+        @param message: The message
+        """
+        if self.args.verbose:
+            print(message)
+            sys.stdout.flush()
+
+    def get_state(self, path):
+        """
+        This method returns the state of an entry, which changes whenever the
+        entry is modified or replaced.
+        @param path: The path of the entry
+        @return: Tuple of the size and modification time, or None if the
+            entry does not exist
+        """
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return stat_result.st_size, stat_result.st_mtime_ns
+
+    def watch_tree(self, directory, root, depth, report):
+        """
+        This method watches a directory and all directories below it that
+        are searched. The entries of the directories are reported as changed
+        if requested, which is necessary for directories that were created
+        after the watch started.
+        @param directory: The directory
+        @param root: The provided directory that contains the directory
+        @param depth: The depth of the directory below the root
+        @param report: If True, the entries are reported as changed
+        """
+        stack = [(directory, depth)]
+        visited = self.handler.get_visited_set([directory])
+        while stack:
+            directory, depth = stack.pop()
+            if not self.inotify.add_watch(directory, root, depth):
+                continue
+            entries = self.handler.list_directory(directory, root, depth)
+            if report:
+                now = time.time()
+                for entry in entries:
+                    self.pending[entry.path] = now
+            if self.args.recursive:
+                for subdirectory in self.handler.get_subdirectories(
+                        entries, depth + 1, visited):
+                    stack.append((subdirectory, depth + 1))
+
+    def start(self):
+        """
+        This method starts watching. It must be called before the initial run
+        so that no changes are missed.
+        """
+        if self.inotify is not None:
+            for root in self.directories:
+                self.watch_tree(root, root, 0, False)
+            self.log('Watching ' + str(len(self.inotify.watches)) +
+                     ' directories with inotify.')
+        else:
+            self.known = self.scan()
+            self.log('Watching ' + str(len(self.directories)) +
+                     ' path(s) by polling every ' +
+                     '{0:g}'.format(mc.WATCH_POLL_INTERVAL) + ' seconds.')
+
+    def scan(self):
+        """
+        This method searches the provided paths like the initial run.
+        @return: Dictionary mapping the paths of all input entries to their
+            states
+        """
+        return dict((entry.path, self.get_state(entry.path))
+                    for entry in self.handler.iter_entries(self.scan_args))
+
+    def is_input(self, path, is_dir, root, depth):
+        """
+        This method checks whether a changed entry is part of the input,
+        applying the same filters as the search of the initial run.
+        @param path: The path of the entry
+        @param is_dir: True if the entry is a directory
+        @param root: The provided directory that contains the entry
+        @param depth: The depth of the entry below the root
+        @return: True if the command is applied to the entry
+        """
+        if self.args.directories != is_dir:
+            return False
+        path_filter = self.handler.path_filter
+        if path_filter is not None and (
+                path_filter.is_excluded(path, root) or
+                not path_filter.is_included(path, root)):
+            return False
+        if depth > 1 and not self.args.recursive:
+            return False
+        if is_dir:
+            return True
+        extension = os.path.splitext(path)[1]
+        pattern = self.patterns[root]
+        return ('ALL' in pattern or extension in pattern) and (
+            self.extensions is None or extension in self.extensions)
+
+    def collect_changes(self, timeout):
+        """
+        This method waits for changes and marks the changed entries as
+        pending.
+        @param timeout: The maximum number of seconds to wait
+        """
+        if self.inotify is None:
+            time.sleep(timeout)
+            state = self.scan()
+            for path, entry_state in state.items():
+                if self.known.get(path) != entry_state:
+                    self.pending[path] = time.time()
+            self.known = state
+            return
+        events = self.inotify.read_events(timeout)
+        # The events may have arrived at the end of the wait:
+        now = time.time()
+        if events is None:
+            # Events were lost, so all entries are checked again:
+            self.log('The inotify queue overflowed. Searching all paths '
+                     'again.')
+            for root in self.directories:
+                self.watch_tree(root, root, 0, True)
+            return
+        for path, is_dir, root, depth in events:
+            if is_dir and self.args.recursive and \
+                    self.handler.get_subdirectories(
+                        [self.handler.make_entry_from_path(path)], depth):
+                # The new directory may already contain entries:
+                self.watch_tree(path, root, depth, True)
+            if self.is_input(path, is_dir, root, depth):
+                self.pending[path] = now
+
+    def get_settled_entries(self):
+        """
+        This method returns the pending entries that have not changed for the
+        debounce delay, in sorted order (in reverse order for directories).
+        Entries that no longer exist or have not changed since they were
+        processed are dropped.
+        @return: List of MapEntry objects
+        """
+        deadline = time.time() - self.args.watch_delay
+        settled = [path for path, changed in self.pending.items()
+                   if changed <= deadline]
+        entries = []
+        for path in sorted(settled, reverse=self.args.directories):
+            del self.pending[path]
+            state = self.get_state(path)
+            if state is None or self.processed.get(path) == state:
+                continue
+            entry = self.handler.make_entry_from_path(path)
+            if entry.is_dir == self.args.directories and \
+                    (entry.is_dir or entry.is_file):
+                entries.append(entry)
+        return entries
+
+    def track(self, entries):
+        """
+        This method returns a generator that yields the entries of the
+        initial run and remembers them, so that their states can be recorded
+        once their commands have finished and the counter can continue.
+        @param entries: Iterable of MapEntry objects
+        @return: Generator of MapEntry objects
+        """
+        for entry in entries:
+            self.count += 1
+            self.initial_entries.append(entry)
+            yield entry
+
+    def record(self, entries):
+        """
+        This method remembers the state of processed entries. The oldest
+        states are forgotten if there are too many.
+        @param entries: The processed MapEntry objects
+        """
+        for entry in entries:
+            self.processed.pop(entry.path, None)
+            self.processed[entry.path] = self.get_state(entry.path)
+        while len(self.processed) > mc.WATCH_HISTORY_SIZE:
+            self.processed.popitem(last=False)
+
+    def get_timeout(self):
+        """
+        This method returns how long to wait for changes.
+        @return: The number of seconds until the next pending entry settles,
+            or the polling interval
+        """
+        timeout = mc.WATCH_POLL_INTERVAL if self.inotify is None \
+            else self.args.watch_delay
+        if self.pending:
+            next_deadline = min(self.pending.values()) + self.args.watch_delay
+            timeout = min(timeout, max(next_deadline - time.time(), 0.0))
+        return timeout
+
+    def watch(self):
+        """
+        This method processes changed entries until it is interrupted or, if
+        errors are not ignored, until a command fails. SIGTERM interrupts the
+        watch like SIGINT, so that the run is finished when map is stopped by
+        a supervisor.
+        """
+        executor = self.runner.executor
+        self.record(self.initial_entries)
+        self.initial_entries.clear()
+        try:
+            previous_handler = signal.signal(signal.SIGTERM, raise_interrupt)
+        except ValueError:
+            # Signal handlers can only be set in the main thread:
+            previous_handler = None
+        try:
+            while True:
+                self.collect_changes(self.get_timeout())
+                entries = self.get_settled_entries()
+                if not entries:
+                    continue
+                self.log('Processing ' + str(len(entries)) +
+                         ' changed entr' + ('ies.' if len(entries) > 1
+                                            else 'y.'))
+                jobs = executor.iter_jobs(entries, self.args, self.count)
+                errors = executor.run_jobs(jobs, self.args)
+                self.count += len(entries)
+                self.record(entries)
+                if errors > 0 and not self.args.ignore_errors:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+
+    def close(self):
+        """
+        This method stops watching.
+        """
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+def raise_interrupt(signal_number, frame):
+    """
+    The method handles SIGTERM like SIGINT by raising a KeyboardInterrupt.
+    @param signal_number: The number of the signal
+    @param frame: The current stack frame
+    """
+    # pylint: disable=unused-argument
+    raise KeyboardInterrupt()
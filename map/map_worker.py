@@ -0,0 +1,193 @@
+"""
+map_worker executes the requests of a map run with long-lived workers
+instead of starting a process per command. The worker protocol is described
+in MapWorker.
+
+Information about map is available at https://github.com/THLO/map.
+"""
+
+import os
+import sys
+import time
+import threading
+import subprocess
+from map.mapper import MapThreadEngine, kill_process_group, \
+    split_arguments
+
+
+class MapWorker(object):
+    """
+    MapWorker is a long-lived process that handles one request after the
+    other. A request is written to the standard input of the worker, and
+    the worker answers each request with a reply on its standard output.
+    Requests and replies end with a newline, or with a null character if
+    '-0' is used. The reply starts with the return code of the request,
+    i.e., 0 if the request succeeded. Anything else that the worker writes
+    must go to its standard error.
+    """
+
+    def __init__(self, command, args):
+        """
+        The constructor starts the worker process. An OSError is raised if
+        the worker cannot be started.
+        @param command: The command that starts the worker
+        @param args: The parsed map arguments
+        """
+        self.delimiter = b'\0' if args.null else b'\n'
+        self.timeout = args.timeout
+        self.timed_out = False
+        self.process = subprocess.Popen(
+            command, shell=not isinstance(command, list),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            start_new_session=args.timeout > 0)
+
+    def is_alive(self):
+        """
+        This method checks whether the worker can handle further requests.
+        @return: True if the worker process is still running
+        """
+        return self.process.poll() is None
+
+    def expire(self):
+        """
+        This method is called when a request times out. The worker is killed
+        together with all processes it has started.
+        """
+        self.timed_out = True
+        kill_process_group(self.process.pid)
+
+    def read_reply(self):
+        """
+        This method reads the next reply of the worker.
+        @return: The reply without the delimiter, or None if the worker has
+            closed its standard output
+        """
+        if self.delimiter == b'\n':
+            reply = self.process.stdout.readline()
+            if not reply.endswith(b'\n'):
+                return None
+            return reply[:-1]
+        reply = []
+        while True:
+            character = self.process.stdout.read(1)
+            if not character:
+                return None
+            if character == self.delimiter:
+                return b''.join(reply)
+            reply.append(character)
+
+    def handle(self, request):
+        """
+        This method sends a request to the worker and waits for the reply.
+        A worker that does not reply, e.g., because it has crashed or timed
+        out, is terminated.
+        @param request: The request
+        @return: Tuple of the return code and a flag that indicates whether
+            the request timed out
+        """
+        timer = None
+        if self.timeout > 0:
+            timer = threading.Timer(self.timeout, self.expire)
+            timer.start()
+        try:
+            self.process.stdin.write(os.fsencode(request) + self.delimiter)
+            self.process.stdin.flush()
+            reply = self.read_reply()
+        except (IOError, OSError):
+            reply = None
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if reply is None:
+            return_code = self.close()
+            return return_code if return_code != 0 else 1, self.timed_out
+        try:
+            return int(reply.split()[0]), False
+        except (ValueError, IndexError):
+            sys.stderr.write('map: invalid reply of worker: ' +
+                             repr(reply) + '\n')
+            return 1, False
+
+    def close(self):
+        """
+        This method closes the standard input of the worker, which asks it
+        to exit, and waits for it to do so.
+        @return: The return code of the worker
+        """
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        return_code = self.process.wait()
+        self.process.stdout.close()
+        return return_code
+
+
+class MapWorkerEngine(MapThreadEngine):
+    """
+    MapWorkerEngine executes requests with long-lived workers instead of
+    starting a process per command. Each thread of a pool owns one worker,
+    which is started when the thread handles its first request and is
+    replaced if it exits.
+    """
+
+    def __init__(self, executor, jobs, args):
+        """
+        The constructor creates the thread pool. The workers are started
+        on demand.
+        @param executor: The MapExecutor
+        @param jobs: The number of workers
+        @param args: The parsed map arguments
+        """
+        super(MapWorkerEngine, self).__init__(executor, jobs, args)
+        self.command = args.worker
+        if args.no_shell:
+            self.command = split_arguments(args.worker)
+        self.local = threading.local()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def handle_request(self, request):
+        """
+        This method handles a request with the worker of the current
+        thread.
+        @param request: The request
+        @return: The MapCommandResult
+        """
+        start = time.time()
+        worker = getattr(self.local, 'worker', None)
+        if worker is None or not worker.is_alive():
+            try:
+                worker = MapWorker(self.command, self.args)
+            except OSError as error:
+                return self.executor.make_result(
+                    self.executor.report_start_error(error, None), None,
+                    None, start)
+            self.local.worker = worker
+            with self.lock:
+                self.workers.append(worker)
+        return_code, timed_out = worker.handle(request)
+        return self.executor.make_result(return_code, None, None, start,
+                                         timed_out=timed_out)
+
+    def submit(self, request):
+        """
+        This method passes a request to the next available worker.
+        @param request: The request
+        @return: The future of the MapCommandResult
+        """
+        return self.pool.submit(self.handle_request, request)
+
+    def close(self, running):
+        """
+        This method waits for the pending requests and stops the workers.
+        Workers that exit with an error are reported.
+        @param running: The futures of the pending requests
+        """
+        super(MapWorkerEngine, self).close(running)
+        for worker in self.workers:
+            if worker.is_alive():
+                return_code = worker.close()
+                if return_code != 0:
+                    sys.stderr.write('map: a worker exited with return code '
+                                     + str(return_code) + '.\n')
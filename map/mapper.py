@@ -13,10 +13,51 @@ More information is available at https://github.com/THLO/map.
 from __future__ import print_function
 import os
 import sys
-import subprocess
-import re
+import itertools
+import collections
+import stat
+import shlex
+import struct
+import time
+import zlib
 from map.map_argument_parser import MapArgumentParser
 from map import map_constants as mc
+from map.map_adaptive import MapConcurrencyController
+from map.map_filter import MapPathFilter
+
+# The modules that are only needed for some runs, e.g., subprocess and the
+# modules of the journal, the caches, and the asyncio and worker engines, are
+# imported where they are used so that map starts quickly, e.g., for --list
+# or --version.
+
+# The size of a pointer in the argument list of a new process:
+POINTER_SIZE = struct.calcsize('P')
+
+
+# A MapEntry describes a file or directory found during the traversal.
+# The type information is taken from the directory listing. The size and the
+# modification time are None unless they were requested, and so are the
+# device and the inode, which identify the file that the entry refers to
+# (the target of a symbolic link):
+MapEntry = collections.namedtuple(
+    'MapEntry', ['path', 'is_dir', 'is_file', 'is_symlink', 'size', 'mtime',
+                 'device', 'inode'])
+
+
+# A MapJob is a command together with the input files, their counts, and
+# their total size in bytes (0 if unknown). Without batching, there is
+# exactly one file per job.
+MapJob = collections.namedtuple(
+    'MapJob', ['command', 'files', 'counts', 'size'])
+
+
+# A MapCommandResult describes an executed command. The output and error
+# output are temporary files if the output is grouped and None otherwise.
+# The resource usage is only determined if statistics are collected.
+# A command that was killed because it exceeded the timeout is timed out.
+MapCommandResult = collections.namedtuple(
+    'MapCommandResult', ['return_code', 'output', 'error_output', 'duration',
+                         'output_bytes', 'rusage', 'timed_out'])
 
 
 class MapInputHandler(object):
@@ -27,8 +68,36 @@ class MapInputHandler(object):
             getFiles(args),
 
     which creates and returns a list of the input files (or directories).
+    The directory tree is traversed with os.scandir so that the file type
+    of each entry is known without additional system calls.
     """
 
+    def __init__(self, with_stat=False, listing_cache=None, shard=None,
+                 path_filter=None, dedup_inodes=False,
+                 follow_symlinks=False):
+        """
+        The constructor creates a MapInputHandler object.
+        @param with_stat: If True, the size and modification time of each
+            entry are determined during the traversal
+        @param listing_cache: The MapListingCache used to avoid reading
+            unchanged directories, or None
+        @param shard: The tuple (index, count) of the shard whose entries
+            directly under the provided paths are processed, or None
+        @param path_filter: The MapPathFilter that excludes and includes
+            entries and limits the depth of the search, or None
+        @param dedup_inodes: If True, the device and inode of each entry
+            are determined during the traversal, and entries that refer to
+            the same file as an entry found before are skipped
+        @param follow_symlinks: If True, symbolic links to directories are
+            searched, and each directory is searched only once
+        """
+        self.with_stat = with_stat
+        self.listing_cache = listing_cache
+        self.shard = shard
+        self.path_filter = path_filter
+        self.dedup_inodes = dedup_inodes
+        self.follow_symlinks = follow_symlinks
+
     def get_directory_dictionary(self, args):
         """
         This function computes a dictionary containing
@@ -75,46 +144,323 @@ class MapInputHandler(object):
                     table[path] = table[path] + "," + extension
         return table
 
-    def create_list_recursively(self, args):
+    def make_entry(self, dir_entry):
+        """
+        This is an internal method that turns an os.DirEntry into a
+        MapEntry. The file type is taken from the directory listing, which
+        does not require a system call on most file systems. Size and
+        modification time are only determined if the handler was created
+        with with_stat=True, and device and inode if it was created with
+        dedup_inodes=True or, for directories, with follow_symlinks=True.
+        A single system call provides all of them.
+        @param dir_entry: The os.DirEntry object
+        @return: The corresponding MapEntry
         """
-        This is an internal method to create the list of input files
-        (or directories) recursively, starting at the provided directory
-        or directories.
+        try:
+            is_dir = dir_entry.is_dir()
+            is_file = not is_dir and dir_entry.is_file()
+            is_symlink = dir_entry.is_symlink()
+        except OSError:
+            is_dir = is_file = is_symlink = False
+        size = mtime = device = inode = None
+        with_identity = self.dedup_inodes or (
+            self.follow_symlinks and is_dir)
+        if (self.with_stat or with_identity) and (is_dir or is_file):
+            try:
+                stat_result = dir_entry.stat()
+                if self.with_stat:
+                    size = stat_result.st_size
+                    mtime = stat_result.st_mtime
+                if with_identity:
+                    device = stat_result.st_dev
+                    inode = stat_result.st_ino
+            except OSError:
+                pass
+        return MapEntry(dir_entry.path, is_dir, is_file, is_symlink, size,
+                        mtime, device, inode)
+
+    def make_entry_from_path(self, path):
+        """
+        This is an internal method that creates a MapEntry for a path that
+        was not found in a directory listing, i.e., a path that was
+        provided directly.
+        @param path: The path
+        @return: The corresponding MapEntry
+        """
+        try:
+            stat_result = os.lstat(path)
+            is_symlink = stat.S_ISLNK(stat_result.st_mode)
+            if is_symlink:
+                stat_result = os.stat(path)
+        except OSError:
+            return MapEntry(path, False, False, False, None, None, None,
+                            None)
+        is_dir = stat.S_ISDIR(stat_result.st_mode)
+        is_file = stat.S_ISREG(stat_result.st_mode)
+        return MapEntry(path, is_dir, is_file, is_symlink,
+                        stat_result.st_size, stat_result.st_mtime,
+                        stat_result.st_dev, stat_result.st_ino)
+
+    def make_entry_from_cache(self, path, is_dir, is_file, is_symlink):
+        """
+        This is an internal method that creates a MapEntry for an entry of a
+        cached directory listing. The size, modification time, device, and
+        inode are not cached and are determined as for make_entry().
+        @param path: The path of the entry
+        @param is_dir: True if the entry is a directory
+        @param is_file: True if the entry is a regular file
+        @param is_symlink: True if the entry is a symbolic link
+        @return: The corresponding MapEntry
+        """
+        size = mtime = device = inode = None
+        with_identity = self.dedup_inodes or (
+            self.follow_symlinks and is_dir)
+        if (self.with_stat or with_identity) and (is_dir or is_file):
+            try:
+                stat_result = os.stat(path)
+                if self.with_stat:
+                    size = stat_result.st_size
+                    mtime = stat_result.st_mtime
+                if with_identity:
+                    device = stat_result.st_dev
+                    inode = stat_result.st_ino
+            except OSError:
+                pass
+        return MapEntry(path, is_dir, is_file, is_symlink, size, mtime,
+                        device, inode)
+
+    def scan_directory(self, path):
+        """
+        This is an internal method that lists the content of a single
+        directory. Directories that cannot be read are treated as empty.
+        If there is a listing cache, the listing of an unchanged directory
+        is taken from the cache.
+        @param path: The directory
+        @return: List of MapEntry objects, sorted by name
+        """
+        if self.listing_cache is not None:
+            try:
+                directory_stat = os.stat(path)
+            except OSError:
+                return []
+            listing = self.listing_cache.get(path, directory_stat)
+            if listing is not None:
+                from map.map_listing_cache import FLAG_DIR, FLAG_FILE, \
+                    FLAG_SYMLINK
+                return [self.make_entry_from_cache(
+                    os.path.join(path, name), bool(flags & FLAG_DIR),
+                    bool(flags & FLAG_FILE), bool(flags & FLAG_SYMLINK))
+                        for name, flags in listing]
+        entries = []
+        try:
+            with os.scandir(path) as iterator:
+                for dir_entry in iterator:
+                    entries.append(self.make_entry(dir_entry))
+        except OSError:
+            return []
+        entries.sort(key=lambda entry: entry.path)
+        if self.listing_cache is not None:
+            self.listing_cache.put(path, directory_stat, entries)
+        return entries
+
+    def list_directory(self, path, root, depth=0):
+        """
+        This is an internal method that lists the content of a directory
+        without the excluded entries. If directory trees are sharded, only
+        the entries of a provided directory that belong to the shard are
+        returned, so that the trees of other shards are not searched.
+        @param path: The directory
+        @param root: The provided directory that contains the directory
+        @param depth: The depth of the directory below the root
+        @return: List of MapEntry objects, sorted by name
+        """
+        entries = self.scan_directory(path)
+        if depth == 0 and self.shard is not None:
+            entries = [entry for entry in entries
+                       if in_shard(entry.path, self.shard)]
+        if self.path_filter is not None:
+            entries = [entry for entry in entries
+                       if not self.path_filter.is_excluded(entry.path, root)]
+        return entries
+
+    def visit(self, entry, visited):
+        """
+        This is an internal method that marks a directory as visited when
+        symbolic links are followed.
+        @param entry: The MapEntry of the directory
+        @param visited: The set of the devices and inodes of the directories
+            that have been visited
+        @return: True if the directory had not been visited before
+        """
+        identity = (entry.device, entry.inode)
+        if entry.inode is None:
+            try:
+                stat_result = os.stat(entry.path)
+            except OSError:
+                return False
+            identity = (stat_result.st_dev, stat_result.st_ino)
+        if identity in visited:
+            return False
+        visited.add(identity)
+        return True
+
+    def get_visited_set(self, roots):
+        """
+        This is an internal method that creates the set of visited
+        directories for a search if symbolic links are followed. The
+        provided directories are marked as visited so that links to them
+        are not followed.
+        @param roots: The directories where the search starts
+        @return: The set of the devices and inodes of the visited
+            directories, or None if symbolic links are not followed
+        """
+        if not self.follow_symlinks:
+            return None
+        visited = set()
+        for root in roots:
+            self.visit(self.make_entry_from_path(root), visited)
+        return visited
+
+    def get_subdirectories(self, entries, depth, visited=None):
+        """
+        This is an internal method that returns the subdirectories of a
+        directory that are searched. Symbolic links to directories are only
+        searched if they are followed, and a directory that has been visited
+        before is not searched again, which breaks cycles of links.
+        @param entries: The entries of the directory
+        @param depth: The depth of the subdirectories below the root
+        @param visited: The set of the visited directories as returned by
+            get_visited_set(), or None
+        @return: List of the paths of the subdirectories
+        """
+        if self.path_filter is not None and \
+                not self.path_filter.allows_descent(depth):
+            return []
+        return [entry.path for entry in entries
+                if entry.is_dir and
+                (not entry.is_symlink or self.follow_symlinks) and
+                (visited is None or self.visit(entry, visited))]
+
+    def walk(self, top, bottom_up=False, root=None, depth=0, visited=None):
+        """
+        This is an internal method that walks the directory tree under 'top'.
+        Similar to os.walk, symbolic links to directories are reported but
+        only followed if requested. Excluded directories are not searched.
+        @param top: The directory where the walk starts
+        @param bottom_up: If True, subdirectories are yielded before their
+            parent directory
+        @param root: The provided directory that contains 'top', or None if
+            'top' is the provided directory
+        @param depth: The depth of 'top' below the root
+        @param visited: The set of the visited directories as returned by
+            get_visited_set(), or None
+        @return: Generator of (directory, entries) tuples
+        """
+        if root is None:
+            root = top
+        entries = self.list_directory(top, root, depth)
+        if not bottom_up:
+            yield top, entries
+        for subdirectory in self.get_subdirectories(entries, depth + 1,
+                                                    visited):
+            for item in self.walk(subdirectory, bottom_up, root, depth + 1,
+                                  visited):
+                yield item
+        if bottom_up:
+            yield top, entries
+
+    def walk_concurrently(self, roots, threads, bottom_up=False,
+                          visited=None):
+        """
+        This is an internal method that walks the directory trees under all
+        given roots using a pool of threads, which read sibling directories
+        concurrently. The directories are yielded in the order in which
+        their listings arrive.
+        If bottom_up is True, a directory is only yielded once all of its
+        subdirectories have been yielded.
+        @param roots: The directories where the walk starts
+        @param threads: The number of threads
+        @param bottom_up: If True, subdirectories are yielded before their
+            parent directory
+        @param visited: The set of the visited directories as returned by
+            get_visited_set(), or None
+        @return: Generator of (root, directory, entries) tuples
+        """
+        from concurrent import futures
+        with futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            # Each pending listing is mapped to its root, the directory, its
+            # parent node, and its depth:
+            pending = {}
+            for root in roots:
+                pending[pool.submit(self.list_directory, root, root)] = \
+                    (root, root, None, 0)
+            while pending:
+                done, _ = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    root, directory, parent, depth = pending.pop(future)
+                    entries = future.result()
+                    subdirectories = self.get_subdirectories(
+                        entries, depth + 1, visited)
+                    # A node holds the directory, its entries, the number of
+                    # subdirectories that are not yet complete, and its parent:
+                    node = [root, directory, entries, len(subdirectories),
+                            parent]
+                    for subdirectory in subdirectories:
+                        pending[pool.submit(
+                            self.list_directory, subdirectory, root,
+                            depth + 1)] = (root, subdirectory, node, depth + 1)
+                    if not bottom_up:
+                        yield root, directory, entries
+                        continue
+                    # Complete the node and all ancestors that only waited
+                    # for this node:
+                    while node is not None and node[3] == 0:
+                        yield node[0], node[1], node[2]
+                        node = node[4]
+                        if node is not None:
+                            node[3] -= 1
+
+    def walk_roots(self, roots, args):
+        """
+        This is an internal method that walks the directory trees under all
+        given roots, using multiple threads if requested. In verbose mode,
+        the walk throughput is reported at the end.
+        @param roots: The directories where the walk starts
         @param args: The parsed map arguments
-        @return: List of map input files of directories
+        @return: Generator of (root, directory, entries) tuples
         """
-        result_list = []
-        directory_dict = self.get_directory_dictionary(args)
-        for key in directory_dict:
-            # Walk through the directory to find al	l input
-            for path, directories, files in os.walk(key):
-                for directory in directories:
-                    result_list.append(os.path.join(path, directory))
-                # Append the file if every file or the file's extension is
-                # allowed to be mapped:
-                for filename in files:
-                    pattern = directory_dict[key].split(',')
-                    if 'ALL' in pattern or \
-                       os.path.splitext(filename)[1] in pattern:
-                        result_list.append(os.path.join(path, filename))
-        return list(set(result_list))
-
-    def create_list(self, args):
-        """
-        This is an internal method to create the list of input files
-        (or directories) contained in the provided directory or directories.
-        @param args: The parsed map arguments
-        @return: List of map input files of directories
-        """
-        result_list = []
-        if len(args.path) == 1 and os.path.isdir(args.path[0]):
-            result_list = [os.path.join(args.path[0], f)
-                           for f in os.listdir(args.path[0])]
+        threads = args.walk_threads
+        if threads == 0:
+            threads = os.cpu_count() or 1
+        visited = self.get_visited_set(roots)
+        if threads > 1:
+            walker = self.walk_concurrently(roots, threads, args.directories,
+                                            visited)
         else:
-            # If there are multiple items, wildcard expansion has already
-            # created the list of files.
-            result_list = args.path
-        return list(set(result_list))
+            walker = ((root, directory, entries) for root in roots
+                      for directory, entries in self.walk(
+                          root, args.directories, visited=visited))
+        num_directories = 0
+        num_entries = 0
+        elapsed = 0.0
+        while True:
+            # Only the time spent walking is measured:
+            start = time.time()
+            item = next(walker, None)
+            elapsed += time.time() - start
+            if item is None:
+                break
+            num_directories += 1
+            num_entries += len(item[2])
+            yield item
+        if args.verbose:
+            rate = num_entries / elapsed if elapsed > 0 else 0.0
+            print('Walked ' + str(num_directories) + ' directories with ' +
+                  str(num_entries) + ' entries in ' + '{0:.3f}'.format(
+                      elapsed) + ' seconds (' + '{0:.0f}'.format(rate) +
+                  ' entries per second, ' + str(threads) + ' thread' +
+                  ('s' if threads > 1 else '') + ').')
 
     def get_extension_list(self, extensions):
         """
@@ -139,20 +485,169 @@ class MapInputHandler(object):
                 extension_list.append(ext_with_dot)
         return list(set(extension_list))
 
-    def get_files(self, args):
+    def roots_overlap(self, roots):
         """
-        This is the main method of the class. Given the arguments,
-        the corresponding list of all files (or directories if the '-d'
-        argument is used) are returned.
+        This is an internal method that checks whether any of the given
+        directories lies within another one, in which case the same file can
+        be reached from multiple roots.
+        @param roots: The directories
+        @return: True if at least one directory contains another one
+        """
+        absolute_roots = [os.path.join(os.path.abspath(root), '')
+                          for root in roots]
+        for index, root in enumerate(absolute_roots):
+            for other_index, other in enumerate(absolute_roots):
+                if index != other_index and root.startswith(other):
+                    return True
+        return False
+
+    def iter_entries_recursively(self, args):
+        """
+        This is an internal method that yields the input files (or
+        directories) recursively, starting at the provided directory or
+        directories. The entries of each directory are yielded in sorted
+        order, but there is no global sort.
+        When the directories are requested, the tree is walked bottom-up
+        so that subfolders are yielded before their parent folder.
+        If multiple walk threads are used, the directories are processed in
+        the order in which their listings arrive.
+        Paths are only remembered if the same file can be reached from
+        several of the provided directories.
         @param args: The parsed map arguments
-        @return: List of files or directories
+        @return: Generator of MapEntry objects
+        """
+        directory_dict = self.get_directory_dictionary(args)
+        seen = set() if self.roots_overlap(list(directory_dict)) else None
+        # The extensions of each directory are split only once:
+        patterns = dict((key, frozenset(directory_dict[key].split(',')))
+                        for key in directory_dict)
+        path_filter = self.path_filter
+        for key, _, entries in self.walk_roots(list(directory_dict), args):
+            pattern = patterns[key]
+            for entry in entries:
+                if args.directories:
+                    if not entry.is_dir:
+                        continue
+                elif not entry.is_file or (
+                        'ALL' not in pattern and
+                        os.path.splitext(entry.path)[1] not in pattern):
+                    continue
+                if path_filter is not None and \
+                        not path_filter.is_included(entry.path, key):
+                    continue
+                if seen is not None:
+                    if entry.path in seen:
+                        continue
+                    seen.add(entry.path)
+                yield entry
+
+    def iter_entries_in_list(self, args):
+        """
+        This is an internal method that yields the input files (or
+        directories) contained in the provided directory or directories.
+        @param args: The parsed map arguments
+        @return: Generator of MapEntry objects
+        """
+        if len(args.path) == 1 and os.path.isdir(args.path[0]):
+            root = args.path[0]
+            for entry in self.list_directory(root, root):
+                if self.path_filter is None or \
+                        self.path_filter.is_included(entry.path, root):
+                    yield entry
+        else:
+            # If there are multiple items, wildcard expansion has already
+            # created the list of files, which only needs to be deduplicated:
+            seen = set()
+            for element in args.path:
+                if element not in seen and (
+                        self.shard is None or in_shard(element, self.shard)) \
+                        and self.is_selected(element):
+                    seen.add(element)
+                    yield self.make_entry_from_path(element)
+
+    def is_selected(self, path):
+        """
+        This is an internal method that applies the exclude and include
+        patterns to a path that was provided directly.
+        @param path: The path
+        @return: True if the path is not excluded and matches the include
+            patterns, if there are any
+        """
+        return self.path_filter is None or (
+            not self.path_filter.is_excluded(path, '') and
+            self.path_filter.is_included(path, ''))
+
+    def iter_entries_from_file(self, args):
+        """
+        This is an internal method that yields the input files (or
+        directories) listed in the file given with --from-file. The paths
+        are read incrementally, so that the list is never held in memory.
+        @param args: The parsed map arguments
+        @return: Generator of MapEntry objects
+        """
+        delimiter = b'\0' if args.null else b'\n'
+        if args.from_file == '-':
+            stream = getattr(sys.stdin, 'buffer', sys.stdin)
+            paths = iter_paths(stream, delimiter)
+        else:
+            paths = iter_paths(open(args.from_file, 'rb'), delimiter, True)
+        for path in paths:
+            if (self.shard is None or in_shard(path, self.shard)) and \
+                    self.is_selected(path):
+                yield self.make_entry_from_path(path)
+
+    def iter_entries(self, args):
+        """
+        This method yields a MapEntry for each file (or directory if the
+        '-d' argument is used) as soon as it is discovered. If inodes are
+        deduplicated, only the first path found for each file is yielded.
+        @param args: The parsed map arguments
+        @return: Generator of MapEntry objects
+        """
+        if args.from_file is not None:
+            candidates = self.iter_entries_from_file(args)
+        elif args.recursive:
+            candidates = self.iter_entries_recursively(args)
+        else:
+            candidates = self.iter_entries_in_list(args)
+        extension_list = None
+        if args.extensions is not None:
+            extension_list = frozenset(
+                self.get_extension_list(args.extensions))
+        seen = set() if self.dedup_inodes else None
+        for entry in candidates:
+            if args.directories:
+                if not entry.is_dir:
+                    continue
+            elif not entry.is_file or (
+                    extension_list is not None and
+                    os.path.splitext(entry.path)[1] not in extension_list):
+                continue
+            if seen is not None and entry.inode is not None:
+                identity = (entry.device, entry.inode)
+                if identity in seen:
+                    continue
+                seen.add(identity)
+            yield entry
+
+    def iter_files(self, args):
+        """
+        This is the streaming counterpart of get_files(). The files (or
+        directories if the '-d' argument is used) are yielded as soon as
+        they are discovered instead of being collected and sorted first.
+        @param args: The parsed map arguments
+        @return: Generator of files or directories
+        """
+        for entry in self.iter_entries(args):
+            yield entry.path
+
+    def get_entries(self, args):
+        """
+        Given the arguments, this method returns the MapEntry objects of all
+        input files (or directories if the '-d' argument is used).
+        @param args: The parsed map arguments
+        @return: List of MapEntry objects
         """
-        file_list = []
-        # The list is created by going through the folder(s) recursively:
-        if args.recursive:
-            file_list = self.create_list_recursively(args)
-        else:    # The list is created by going through the provided folder(s):
-            file_list = self.create_list(args)
         if args.directories:
             # If directories are returned, the list is sorted in reverse order.
             # This allows the processing of subfolders before the processing of
@@ -160,168 +655,209 @@ class MapInputHandler(object):
             # Processing the parent folder first may not work because the
             # command may remove or rename the folder, which would affect
             # the subfolders.
-            file_list = \
-                [element for element in file_list if os.path.isdir(element)]
-            return sorted(file_list, reverse=True)
-        else:
-            # Filter out all directories:
-            file_list = \
-                [element for element in file_list if os.path.isfile(element)]
-            # Files are filtered based on their extensions:
-            if args.extensions is not None:
-                extension_list = self.get_extension_list(args.extensions)
-                file_list = \
-                    [element for element in file_list if
-                     os.path.splitext(element)[1] in extension_list]
-            # The files in the list are sorted in lexicographical order:
-            return sorted(file_list)
+            return sorted(self.iter_entries(args), reverse=True)
+        # The files in the list are sorted in lexicographical order:
+        return sorted(self.iter_entries(args))
+
+    def get_files(self, args):
+        """
+        This is the main method of the class. Given the arguments,
+        the corresponding list of all files (or directories if the '-d'
+        argument is used) are returned.
+        @param args: The parsed map arguments
+        @return: List of files or directories
+        """
+        return [entry.path for entry in self.get_entries(args)]
 
 
 class MapExecutor(object):
     """
     MapExecutor builds the command for each file (or directory) in a list.
     It further executes the set of commands.
+    Internally, each command is wrapped in a MapJob together with the files
+    it was built for.
     The commands are built by calling
 
         buildCommands(files)
 
-    and the resulting commands are executed in succession by calling
+    and the resulting commands are executed, in succession or using a
+    bounded pool of workers, by calling
 
         runCommands(commands)
     """
 
-    def replace_in_commmand(self, command, pattern, replacement,
-                            replacement_at_beginning):
+    def __init__(self, journal=None, statistics=None):
         """
-        This method replaces a certain 'pattern' in the provided command with a
-        'replacement'.
-        A different replacement can be specified when the pattern occurs right
-        at the beginning of the command.
-        @param command: The command
-        @param pattern: The pattern
-        @param replacement: The replacement for the pattern
-        @param replacement_at_beginning: The replacement at the beginning
-        @return: The updated command
-        """
-        # Turn the command into a list:
-        command_list = list(command)
-        # Get the indices of the pattern in the list:
-        indices = [index.start() for index in re.finditer(pattern, command)]
-        # Replace at the indices, unless the preceding character is the
-        # escape character:
-        for index in indices:
-            if index == 0:
-                command_list[index] = replacement_at_beginning
-            elif command_list[index-1] != mc.ESCAPE_CHARACTER:
-                command_list[index] = replacement
-        # Put the pieces of the new command together:
-        new_command = ''.join(command_list)
-        # Remove superfluous slashes and return:
-        return new_command.replace("//", "/")
-
-    def escape_placeholders(self, input_string):
+        The constructor creates a MapExecutor object.
+        @param journal: The MapJournal used to skip files that have already
+            been processed, or None
+        @param statistics: The MapStatistics that record the results of the
+            commands, or None
         """
-        This method escapes all the placeholders defined in map_constants.py.
-        @param input_string: The input string
-        @return: The input with escaped placeholders
-        """
-        escape_char = mc.ESCAPE_CHARACTER
-        escaped = input_string.replace(
-            mc.PLACEHOLDER, escape_char + mc.PLACEHOLDER)
-        escaped = escaped.replace(
-            mc.PLACEHOLDER_FILENAME, escape_char + mc.PLACEHOLDER_FILENAME)
-        escaped = escaped.replace(
-            mc.PLACEHOLDER_PATH, escape_char + mc.PLACEHOLDER_PATH)
-        escaped = escaped.replace(
-            mc.PLACEHOLDER_EXTENSION, escape_char + mc.PLACEHOLDER_EXTENSION)
-        escaped = escaped.replace(
-            mc.PLACEHOLDER_COUNTER, escape_char + mc.PLACEHOLDER_COUNTER)
-        return escaped
+        self.template = None
+        self.journal = journal
+        self.statistics = statistics
+        # The MapResultCache that replays the results of commands, which
+        # depends on the compiled command template:
+        self.result_cache = None
+        # The number of files skipped because of the journal:
+        self.skipped = 0
 
-    def unescape_placeholders(self, input_string):
+    def get_template(self, args):
         """
-        This method removes the escape characters.
-        @param input_string: The input string
-        @return: The input string without escape characters
+        This method returns the compiled command template. The template is
+        only compiled again if the command or the counter format changes.
+        @param args: The parsed map arguments
+        @return: The MapCommandTemplate for the command
         """
-        return input_string.replace(mc.ESCAPE_CHARACTER, '')
+        if self.template is None or \
+                self.template.command != args.command or \
+                self.template.number_length != args.number_length or \
+                self.template.shell == args.no_shell:
+            self.template = MapCommandTemplate(
+                args.command, args.number_length, shell=not args.no_shell)
+        return self.template
 
-    def build_part(self, command_part, filename_with_path, count, args):
+    def build_command(self, filename, count, args):
         """
-        This method builds a part of the command. It is used in the method
-        build_command().
-        @param command_part: Part of the command
-        @param filename_with_path: Filename with path
+        This method builds the command for a particular file.
+        @param filename: The input filename
         @param count: The current count
         @param args: The parsed map arguments
-        @return: The built command part
+        @return: The built command, which is a list of arguments if the
+            command is executed without a shell
         """
-        # Get the path to the file:
-        file_path = os.path.split(filename_with_path)[0]
-        # Append '/' if there is a path, i.e., the file is not in the local
-        # directory:
-        if file_path != '':
-            file_path += '/'
-        # Get the file name without the path:
-        filename_without_path = os.path.basename(filename_with_path)
-        # Get the file name without the path and without the extension:
-        plain_filename = os.path.splitext(filename_without_path)[0]
-        # Get the extension:
-        file_extension = os.path.splitext(filename_without_path)[1]
-
-        # The original command part is retained:
-        original_command_part = command_part
-
-        # Replace the file placeholder character with the file:
-        command_part = self.replace_in_commmand(
-            command_part, mc.PLACEHOLDER, filename_without_path,
-            filename_with_path)
-        # Replace the path placeholder with the path:
-        command_part = self.replace_in_commmand(
-            command_part, mc.PLACEHOLDER_PATH, file_path, file_path)
-        # Replace the plain file placeholder with the plain file:
-        command_part = self.replace_in_commmand(
-            command_part, mc.PLACEHOLDER_FILENAME, plain_filename,
-            plain_filename)
-        # Replace the extension placeholder with the extension:
-        command_part = self.replace_in_commmand(
-            command_part, mc.PLACEHOLDER_EXTENSION, file_extension,
-            file_extension)
-        # Replace the placeholder for the counter with the actual count:
-        if args.number_length == 0:
-            replacement_string = str(count)
-        else:
-            replacement_string = (
-                '{0:0'+str(args.number_length)+'d}').format(count)
-        command_part = self.replace_in_commmand(
-            command_part, mc.PLACEHOLDER_COUNTER, replacement_string,
-            replacement_string)
-        # If the command part changed, it is put in quotes to avoid problems
-        # with special characters:
-        if original_command_part != command_part:
-            command_part = '\"' + command_part + '\"'
-        return command_part
+        template = self.get_template(args)
+        if args.worker is not None:
+            return template.build_request(filename, count)
+        if args.no_shell:
+            return template.build_argv(filename, count)
+        return template.build(filename, count)
 
-    def build_command(self, filename, count, args):
+    def get_signature(self, filename, count, args):
         """
-        This method builds the command for a particular file.
+        This method returns the command that identifies how a file is
+        processed, which is recorded in the journal. It is the command that
+        is built for the file alone, even if batching is enabled.
         @param filename: The input filename
-        @param count: The current count
+        @param count: The count of the file
         @param args: The parsed map arguments
-        @return: The built command
+        @return: The command as a string
         """
-        # Escape all placeholders in the file path:
-        filename_with_path = self.escape_placeholders(filename)
+        return format_command(self.build_command(filename, count, args))
 
-        # The command is split into 'parts' separated by blank spaces:
-        command_parts = args.command.split(' ')
-        processed_parts = []
-        # Each part of the command is processed separately:
-        for part in command_parts:
-            processed_parts.append(self.build_part(
-                part, filename_with_path, count, args))
-        # The parts are put together and the new command is returned:
-        return self.unescape_placeholders(' '.join(processed_parts))
+    def is_complete(self, entry, count, args):
+        """
+        This method checks whether the journal records that the file has
+        already been processed and has not changed since.
+        @param entry: The MapEntry of the file
+        @param count: The count of the file
+        @param args: The parsed map arguments
+        @return: True if the file can be skipped
+        """
+        if self.journal is None:
+            return False
+        if self.journal.is_complete(
+                entry.path, entry.size, entry.mtime,
+                self.get_signature(entry.path, count, args)):
+            self.skipped += 1
+            return True
+        return False
+
+    def iter_jobs(self, entries, args, count_from=None):
+        """
+        This method lazily builds a job for each (input) file, or for each
+        batch of files if batching is enabled, as the entries are consumed.
+        In batch mode, the parts of the command that contain placeholders
+        are repeated for each file, and as many files are put into a single
+        command as the argument limit of the system and the maximum batch
+        size allow.
+        Each file is assigned its count before files recorded in the journal
+        or belonging to another shard are skipped so that the counts do not
+        depend on previous runs or on the shard.
+        @param entries: Iterable of MapEntry objects
+        @param args: The parsed map arguments
+        @param count_from: The count of the first file, or None to start at
+            the value of '-c'
+        @return: Generator of MapJob objects
+        """
+        template = self.get_template(args)
+        batching = args.batch or args.max_batch > 0
+        if batching:
+            limit = get_argument_limit(template.shell)
+            base_size = template.get_size()
+            size = base_size
+        batch = []
+        batch_files = []
+        batch_counts = []
+        batch_input_size = 0
+        # Directory trees are sharded while the input is collected:
+        shard = args.shard if not args.shard_directories else None
+        count = args.count_from if count_from is None else count_from
+        for entry in entries:
+            current_count = count
+            count += 1
+            if shard is not None and not in_shard(entry.path, shard):
+                continue
+            if self.is_complete(entry, current_count, args):
+                continue
+            if not batching:
+                yield MapJob(
+                    self.build_command(entry.path, current_count, args),
+                    [entry.path], [current_count], entry.size or 0)
+                continue
+            expansion = template.expand(entry.path, current_count)
+            expansion_size = template.get_size(expansion)
+            # The batch is complete if the file does not fit anymore:
+            if batch and (size + expansion_size > limit or
+                          len(batch) == args.max_batch):
+                yield MapJob(template.assemble(batch), batch_files,
+                             batch_counts, batch_input_size)
+                batch = []
+                batch_files = []
+                batch_counts = []
+                batch_input_size = 0
+                size = base_size
+            batch.append(expansion)
+            batch_files.append(entry.path)
+            batch_counts.append(current_count)
+            batch_input_size += entry.size or 0
+            size += expansion_size
+        if batch:
+            yield MapJob(template.assemble(batch), batch_files, batch_counts,
+                         batch_input_size)
+
+    def schedule_jobs(self, jobs, args):
+        """
+        This method orders the jobs for dispatching. By default, the jobs
+        are dispatched in the order of the input. With the 'largest-first'
+        schedule, the jobs with the largest input are dispatched first so
+        that a few large files do not delay the end of a parallel run. The
+        counts have already been assigned in the order of the input and
+        are not affected.
+        @param jobs: The list of MapJob objects
+        @param args: The parsed map arguments
+        @return: The list of MapJob objects in the order of dispatching
+        """
+        if args.schedule == mc.SCHEDULE_LARGEST_FIRST:
+            # The sort is stable, i.e., jobs of equal size keep their order:
+            return sorted(jobs, key=lambda job: job.size, reverse=True)
+        return jobs
+
+    def iter_commands(self, files, args):
+        """
+        This method lazily builds the command for each (input) file, or for
+        each batch of files if batching is enabled, as the files are
+        consumed.
+        @param files: Iterable of input files
+        @param args: The parsed map arguments
+        @return: Generator of commands
+        """
+        entries = (MapEntry(filename, None, None, None, None, None, None,
+                            None)
+                   for filename in files)
+        for job in self.iter_jobs(entries, args):
+            yield job.command
 
     def build_commands(self, files, args):
         """
@@ -330,48 +866,416 @@ class MapExecutor(object):
         @param files: The input files
         @param args: The parsed map arguments
         """
-        commands = []
-        count = args.count_from
-        # For each file, a command is created:
-        for filename in files:
-            commands.append(self.build_command(filename, count, args))
-            count += 1
-        return commands
+        return list(self.iter_commands(files, args))
 
-    def run_commands(self, commands, args):
+    def complete_job(self, job, args):
         """
-        Given a list of commands, this method executes them.
-        This is one of the two key methods of MapExecutor.
-        @param commands: The commands to be executed
+        This method is called when a job has succeeded. The files of the
+        job are recorded in the journal.
+        @param job: The MapJob
         @param args: The parsed map arguments
         """
-        error_counter = 0
-        if args.list:
-            print('\n'.join(commands))
+        if self.journal is not None:
+            for filename, count in zip(job.files, job.counts):
+                self.journal.record(
+                    filename, self.get_signature(filename, count, args))
+
+    def announce_command(self, command, args):
+        """
+        This method is called right before a command is started. In verbose
+        mode, the command is printed. The standard output is flushed so that
+        map's own output is not mixed up with the output of the command.
+        @param command: The command that is about to be executed
+        @param args: The parsed map arguments
+        """
+        if args.verbose:
+            print('Executing command: '+format_command(command))
+        sys.stdout.flush()
+
+    def open_output(self, args):
+        """
+        This method creates the temporary files that the output of a command
+        is spooled to if the output is grouped or stored in the result cache.
+        @param args: The parsed map arguments
+        @return: Tuple of the files for the output and the error output, or
+            (None, None) if the output is not grouped
+        """
+        if args.group_output or self.result_cache is not None:
+            import tempfile
+            return tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        return None, None
+
+    def report_start_error(self, error, error_output):
+        """
+        This method reports that a command could not be started, e.g.,
+        because the program does not exist.
+        @param error: The OSError
+        @param error_output: The temporary file of the error output, or None
+        @return: The return code of the command
+        """
+        message = 'map: ' + str(error) + '\n'
+        if error_output is not None:
+            error_output.write(message.encode('utf-8'))
         else:
-            # Each command is executed sequentially:
-            for command in commands:
-                process = subprocess.Popen(
-                    command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                    shell=True)
-                stream = process.communicate()
-                output = stream[0]
-                error_output = stream[1]
-                return_code = process.returncode
-                if args.verbose:
-                    print('Executing command: '+command)
-                if return_code != 0:
-                    error_counter += 1
-                    if args.verbose or not args.ignore_errors:
-                        print('An error occurred:\n')
-                        print(error_output)
-                    if not args.ignore_errors:
-                        print('Terminating map process.')
+            sys.stderr.write(message)
+            sys.stderr.flush()
+        return 127
+
+    def make_result(self, return_code, output, error_output, start,
+                    rusage=None, timed_out=False):
+        """
+        This method creates the result of a command that has finished.
+        @param return_code: The return code of the command
+        @param output: The temporary file of the output, or None
+        @param error_output: The temporary file of the error output, or None
+        @param start: The time when the command was started
+        @param rusage: The resource usage of the command, or None
+        @param timed_out: True if the command was killed after the timeout
+        @return: The MapCommandResult
+        """
+        output_bytes = None
+        if output is not None:
+            output_bytes = os.fstat(output.fileno()).st_size + \
+                os.fstat(error_output.fileno()).st_size
+        return MapCommandResult(return_code, output, error_output,
+                                time.time() - start, output_bytes, rusage,
+                                timed_out)
+
+    def lookup_result(self, job, args):
+        """
+        This method looks up the result of a job in the result cache. The
+        result of a hit is replayed from the files in the cache.
+        @param job: The MapJob
+        @param args: The parsed map arguments
+        @return: The MapCommandResult, or None if the command must be
+            executed
+        """
+        if self.result_cache is None:
+            return None
+        start = time.time()
+        cached = self.result_cache.lookup(job)
+        if cached is None:
+            return None
+        if args.verbose:
+            print('Using cached result: ' + format_command(job.command))
+        try:
+            output = open(cached.output, 'rb')
+            error_output = open(cached.error_output, 'rb')
+        except (IOError, OSError):
+            return None
+        return self.make_result(cached.return_code, output, error_output,
+                                start)
+
+    def execute_command(self, command, args):
+        """
+        This method executes a single command and waits for it to finish.
+        A command that is a list of arguments is executed directly instead
+        of via the shell.
+        By default, the command writes to map's standard output and standard
+        error directly. If the output is grouped, it is spooled to temporary
+        files instead, which are returned.
+        If there is a timeout, the command runs in its own process group,
+        which is killed when the timeout expires.
+        If statistics are collected, the resource usage of the child process
+        is obtained with os.wait4, unless there is a timeout.
+        @param command: The command to be executed
+        @param args: The parsed map arguments
+        @return: The MapCommandResult
+        """
+        import subprocess
+        shell = not isinstance(command, list)
+        output, error_output = self.open_output(args)
+        start = time.time()
+        rusage = None
+        timed_out = False
+        try:
+            process = subprocess.Popen(
+                command, stdout=output, stderr=error_output, shell=shell,
+                start_new_session=args.timeout > 0)
+        except OSError as error:
+            return_code = self.report_start_error(error, error_output)
+        else:
+            if args.timeout > 0:
+                try:
+                    return_code = process.wait(args.timeout)
+                except subprocess.TimeoutExpired:
+                    kill_process_group(process.pid)
+                    return_code = process.wait()
+                    timed_out = True
+            elif self.statistics is not None and hasattr(os, 'wait4'):
+                _, status, rusage = os.wait4(process.pid, 0)
+                return_code = get_exit_code(status)
+                # The process must not be waited for again:
+                process.returncode = return_code
+            else:
+                return_code = process.wait()
+        return self.make_result(return_code, output, error_output, start,
+                                rusage, timed_out)
+
+    def write_output(self, spooled_output, stream):
+        """
+        This method copies the spooled output of a command to the given
+        stream in chunks and closes the temporary file.
+        @param spooled_output: The temporary file
+        @param stream: The target stream, e.g., sys.stdout
+        """
+        import shutil
+        spooled_output.seek(0)
+        stream.flush()
+        target = getattr(stream, 'buffer', stream)
+        shutil.copyfileobj(spooled_output, target)
+        target.flush()
+        spooled_output.close()
+
+    def report_result(self, command, result, args):
+        """
+        This method reports the result of an executed command.
+        @param command: The executed command
+        @param result: The MapCommandResult
+        @param args: The parsed map arguments
+        @return: True if the command succeeded, False otherwise
+        """
+        if result.output is not None:
+            self.write_output(result.output, sys.stdout)
+        if result.error_output is not None:
+            self.write_output(result.error_output, sys.stderr)
+        if result.timed_out:
+            if args.verbose or not args.ignore_errors:
+                print('The command timed out after ' +
+                      '{0:g}'.format(args.timeout) + ' seconds.')
+            return False
+        if result.return_code != 0:
+            if args.verbose or not args.ignore_errors:
+                print('An error occurred (return code ' +
+                      str(result.return_code) + ').')
+            return False
+        return True
+
+    def finish_job(self, job, result, args):
+        """
+        This method is called when the command of a job has finished. The
+        result is recorded, and the files of a successful job are recorded
+        in the journal.
+        @param job: The MapJob
+        @param result: The MapCommandResult
+        @param args: The parsed map arguments
+        @return: True if the command succeeded, False otherwise
+        """
+        if self.statistics is not None:
+            self.statistics.record_command(job, result)
+        if result.return_code != 0 or result.timed_out:
+            return False
+        self.complete_job(job, args)
+        return True
+
+    def get_number_of_jobs(self, args):
+        """
+        This method returns the number of commands that may run concurrently.
+        The value 0 stands for the number of available cores.
+        @param args: The parsed map arguments
+        @return: The number of parallel jobs
+        """
+        if args.jobs == 0:
+            return os.cpu_count() or 1
+        return args.jobs
+
+    def get_concurrency_controller(self, jobs, args):
+        """
+        This method creates the controller of the adaptive concurrency,
+        which logs the changes in verbose mode.
+        @param jobs: The initial number of parallel jobs
+        @param args: The parsed map arguments
+        @return: The MapConcurrencyController, or None if the concurrency
+            is not adaptive
+        """
+        if not args.adaptive:
+            return None
+        maximum = args.max_jobs
+        if maximum == 0:
+            maximum = (os.cpu_count() or 1) * mc.ADAPTIVE_MAX_JOBS_PER_CORE
+        return MapConcurrencyController(
+            jobs, args.min_jobs, maximum, log=print if args.verbose else None)
+
+    def iter_results_in_parallel(self, map_jobs, jobs, args):
+        """
+        This method executes the jobs using the engine selected with
+        --engine: either a pool of worker threads, each of which waits for
+        one child process at a time, or an asyncio event loop, which waits
+        for all child processes in a single thread.
+        At most 'jobs' commands are in flight at any time, and a new job is
+        only taken from 'map_jobs' when a command has finished, so that a
+        streamed input is not collected faster than it is processed. If the
+        concurrency is adaptive, the limit is adjusted while the commands
+        run.
+        Unless errors are
+        ignored, no new commands are scheduled after the first failure, but
+        the commands that are already running are completed.
+        When directories are processed, a directory's command is only
+        started after the commands of all directories below it have
+        finished, whereas independent subtrees are processed concurrently.
+        The output of commands that run concurrently is interleaved unless
+        it is grouped.
+        @param map_jobs: Iterable of MapJob objects
+        @param jobs: The maximum number of concurrent commands
+        @param args: The parsed map arguments
+        @return: Generator of (MapJob, MapCommandResult) tuples in the order
+            of completion
+        """
+        stop = False
+        job_iterator = iter(map_jobs)
+        exhausted = False
+        # The jobs whose dependencies have finished:
+        ready = collections.deque()
+        tracker = MapDependencyTracker() if args.directories else None
+        controller = self.get_concurrency_controller(jobs, args)
+        timeout = None
+        if controller is not None:
+            # The pool must be large enough for the maximum limit:
+            timeout = controller.interval
+            jobs = controller.maximum
+        if args.worker is not None:
+            from map.map_worker import MapWorkerEngine
+            engine = MapWorkerEngine(self, jobs, args)
+        elif args.engine == mc.ENGINE_ASYNCIO:
+            from map.map_asyncio import MapAsyncioEngine
+            engine = MapAsyncioEngine(self, args)
+        else:
+            engine = MapThreadEngine(self, jobs, args)
+        running = {}
+        try:
+            while True:
+                limit = jobs if controller is None else controller.limit
+                # Fill up the pool unless the process is terminating:
+                while not stop and len(running) < limit:
+                    if ready:
+                        job = ready.popleft()
+                    elif exhausted:
                         break
-                if return_code == 0 and output:
-                    sys.stdout.write(output.decode('utf-8'))
+                    else:
+                        job = next(job_iterator, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        # Jobs that depend on unfinished jobs are held back:
+                        if tracker is not None and not tracker.add(job):
+                            continue
+                    # Cached results are replayed without a command:
+                    result = self.lookup_result(job, args)
+                    if result is not None:
+                        if not self.finish_job(job, result, args) and \
+                                not args.ignore_errors:
+                            stop = True
+                        yield job, result
+                        continue
+                    self.announce_command(job.command, args)
+                    running[engine.submit(job.command)] = job
+                if not running:
+                    break
+                done = engine.wait(running, timeout)
+                if controller is not None:
+                    controller.record(len(done))
+                    controller.update(len(running))
+                for future in done:
+                    job = running.pop(future)
+                    result = future.result()
+                    if self.result_cache is not None:
+                        self.result_cache.store(job, result)
+                    if not self.finish_job(job, result, args) and \
+                            not args.ignore_errors:
+                        stop = True
+                    if tracker is not None:
+                        ready.extend(tracker.complete(job))
+                    yield job, result
+        finally:
+            engine.close(running)
+
+    def iter_results(self, map_jobs, args):
+        """
+        This method lazily executes the jobs, in parallel if requested, and
+        yields the result of each job as soon as its command has finished.
+        The results are recorded, but they are not reported. Unless errors
+        are ignored, no new commands are started after the first failure.
+        @param map_jobs: Iterable of MapJob objects
+        @param args: The parsed map arguments
+        @return: Generator of (MapJob, MapCommandResult) tuples
+        """
+        jobs = self.get_number_of_jobs(args)
+        # The input files are hashed ahead of the execution:
+        if self.result_cache is not None:
+            map_jobs = self.result_cache.prefetch(map_jobs)
+        if jobs > 1 or args.engine == mc.ENGINE_ASYNCIO or \
+                args.worker is not None or args.adaptive:
+            for item in self.iter_results_in_parallel(map_jobs, jobs, args):
+                yield item
+            return
+        # Each command is executed sequentially:
+        for job in map_jobs:
+            result = self.lookup_result(job, args)
+            if result is None:
+                self.announce_command(job.command, args)
+                result = self.execute_command(job.command, args)
+                if self.result_cache is not None:
+                    self.result_cache.store(job, result)
+            success = self.finish_job(job, result, args)
+            yield job, result
+            if not success and not args.ignore_errors:
+                return
+
+    def close(self):
+        """
+        This method closes the journal, if there is one.
+        """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def list_jobs(self, map_jobs):
+        """
+        This method writes the commands of the jobs to the standard output.
+        The commands are written as they are built, so that the list is never
+        held in memory. If the output is closed early, e.g., when it is piped
+        into 'head', no more commands are built.
+        @param map_jobs: Iterable of MapJob objects
+        """
+        try:
+            for job in map_jobs:
+                sys.stdout.write(format_command(job.command) + '\n')
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # As recommended by the Python documentation, the standard output
+            # is redirected to devnull so that flushing it again at exit does
+            # not fail:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            os.close(devnull)
+
+    def run_jobs(self, map_jobs, args):
+        """
+        Given a list of jobs, this method executes their commands and
+        reports their results.
+        @param map_jobs: Iterable of MapJob objects
+        @param args: The parsed map arguments
+        @return: The number of failed commands
+        """
+        error_counter = 0
+        try:
+            if args.list:
+                self.list_jobs(map_jobs)
+            else:
+                for job, result in self.iter_results(map_jobs, args):
+                    if not self.report_result(job.command, result, args):
+                        error_counter += 1
+                        if not args.ignore_errors and error_counter == 1:
+                            print('Terminating map process.')
+        finally:
+            # The records of an interrupted run must not get lost:
+            if self.journal is not None:
+                self.journal.flush()
         if args.verbose:
             print('Process completed successfully.')
+            if self.skipped > 0:
+                print(str(self.skipped) + ' unchanged input(s) recorded in '
+                      'the journal skipped.')
             if error_counter > 0:
                 if error_counter > 1:
                     print(str(error_counter)
@@ -379,13 +1283,828 @@ class MapExecutor(object):
                 else:
                     print(str(error_counter)
                           + ' error occurred during the process.')
+        return error_counter
+
+    def run_commands(self, commands, args):
+        """
+        Given a list of commands, this method executes them.
+        This is one of the two key methods of MapExecutor.
+        @param commands: The commands to be executed
+        @param args: The parsed map arguments
+        """
+        self.run_jobs((MapJob(command, [], [], 0) for command in commands),
+                      args)
+
+
+class MapThreadEngine(object):
+    """
+    MapThreadEngine executes commands in a pool of threads. Each thread
+    waits for one child process at a time.
+    """
+
+    def __init__(self, executor, jobs, args):
+        """
+        The constructor creates the thread pool.
+        @param executor: The MapExecutor that executes the commands
+        @param jobs: The number of threads
+        @param args: The parsed map arguments
+        """
+        from concurrent import futures
+        self.executor = executor
+        self.args = args
+        self.pool = futures.ThreadPoolExecutor(max_workers=jobs)
+
+    def submit(self, command):
+        """
+        This method starts the execution of a command.
+        @param command: The command
+        @return: The future of the MapCommandResult
+        """
+        return self.pool.submit(
+            self.executor.execute_command, command, self.args)
+
+    def wait(self, running, timeout=None):
+        """
+        This method waits until at least one of the commands has finished
+        or the timeout has expired.
+        @param running: The futures of the running commands
+        @param timeout: The maximum number of seconds to wait, or None
+        @return: The set of futures whose commands have finished
+        """
+        from concurrent import futures
+        done, _ = futures.wait(running, timeout,
+                               return_when=futures.FIRST_COMPLETED)
+        return done
+
+    def close(self, running):
+        """
+        This method waits for the running commands and shuts the pool down.
+        @param running: The futures of the running commands
+        """
+        self.pool.shutdown(wait=True)
+
+
+class MapDependencyTracker(object):
+    """
+    MapDependencyTracker treats the directories processed by map as a tree.
+    The job of a directory depends on the jobs of all directories below it,
+    because its command may rename or move the directory. Jobs must be added
+    in an order in which descendants come before their ancestors, which is
+    the case for the reverse sorted input as well as for the streamed input.
+    A job is ready once all of its dependencies are complete:
+
+        add(job)        returns True if the job is ready right away
+        complete(job)   returns the jobs that have become ready
+    """
+
+    def __init__(self):
+        """ The constructor creates a MapDependencyTracker object."""
+        self.cwd = os.getcwd()
+        # A node consists of the job, the number of unfinished dependencies,
+        # the ids of the dependent jobs, and the normalized paths of the job:
+        self.nodes = {}
+        # For each directory, the ids of the unfinished jobs below it:
+        self.pending = {}
+
+    def normalize(self, path):
+        """
+        This method returns the absolute, normalized form of a path without
+        accessing the file system.
+        @param path: The path
+        @return: The normalized path
+        """
+        return os.path.normpath(os.path.join(self.cwd, path))
+
+    def get_ancestors(self, path):
+        """
+        This method returns all parent directories of a normalized path.
+        @param path: The normalized path
+        @return: Generator of the parent directories
+        """
+        parent = os.path.dirname(path)
+        while parent != path:
+            yield parent
+            path = parent
+            parent = os.path.dirname(path)
+
+    def add(self, job):
+        """
+        This method adds a job whose dependencies are the unfinished jobs of
+        all directories below the job's directories.
+        @param job: The MapJob
+        @return: True if the job does not depend on any unfinished job
+        """
+        job_id = id(job)
+        paths = [self.normalize(path) for path in job.files]
+        dependencies = set()
+        for path in paths:
+            dependencies.update(self.pending.get(path, ()))
+        dependencies.discard(job_id)
+        for dependency in dependencies:
+            self.nodes[dependency][2].append(job_id)
+        self.nodes[job_id] = [job, len(dependencies), [], paths]
+        for path in paths:
+            for ancestor in self.get_ancestors(path):
+                self.pending.setdefault(ancestor, set()).add(job_id)
+        return not dependencies
+
+    def complete(self, job):
+        """
+        This method marks a job as complete.
+        @param job: The MapJob that was passed to add()
+        @return: List of the jobs that have become ready
+        """
+        job_id = id(job)
+        _, _, dependents, paths = self.nodes.pop(job_id)
+        for path in paths:
+            for ancestor in self.get_ancestors(path):
+                pending = self.pending.get(ancestor)
+                if pending is not None:
+                    pending.discard(job_id)
+                    if not pending:
+                        del self.pending[ancestor]
+        ready = []
+        for dependent in dependents:
+            node = self.nodes[dependent]
+            node[1] -= 1
+            if node[1] == 0:
+                ready.append(node[0])
+        return ready
+
+
+class MapCommandTemplate(object):
+    """
+    MapCommandTemplate is the compiled form of a command.
+    The command is split into parts separated by blank spaces, and each part
+    is parsed once into literal text and placeholder slots. Escape
+    characters are resolved during the compilation. A command for a
+    particular file is then built by calling
+
+        build(filename, count)
+
+    which fills all slots with a single call to str.format.
+    If the command is executed without a shell, it is instead tokenized
+    with shlex once, and
+
+        build_argv(filename, count)
+
+    fills the slots of each argument separately. No quotes are needed in
+    this case.
+    """
+
+    # The slots that the placeholders are compiled to. The placeholder for
+    # the file refers to the file including its path at the beginning of a
+    # part and to the file name without the path anywhere else:
+    SLOT_FILE = 0
+    SLOT_FILE_WITHOUT_PATH = 1
+    SLOT_PATH = 2
+    SLOT_FILENAME = 3
+    SLOT_EXTENSION = 4
+    SLOT_COUNTER = 5
+
+    PLACEHOLDER_SLOTS = {
+        mc.PLACEHOLDER: SLOT_FILE_WITHOUT_PATH,
+        mc.PLACEHOLDER_PATH: SLOT_PATH,
+        mc.PLACEHOLDER_FILENAME: SLOT_FILENAME,
+        mc.PLACEHOLDER_EXTENSION: SLOT_EXTENSION,
+        mc.PLACEHOLDER_COUNTER: SLOT_COUNTER}
+
+    def __init__(self, command, number_length=0, shell=True):
+        """
+        The constructor compiles the given command.
+        A ValueError is raised if the command cannot be tokenized when
+        running without a shell, e.g., because of a missing closing quote.
+        @param command: The command containing placeholders
+        @param number_length: The number of digits of the counter
+        @param shell: If False, the command is compiled into a list of
+            arguments that is executed without a shell
+        """
+        self.command = command
+        self.number_length = number_length
+        if number_length == 0:
+            self.counter_format = '{0}'
+        else:
+            self.counter_format = '{0:0' + str(number_length) + 'd}'
+        # Each part is a list of literal strings and slots:
+        self.parts = [self.compile_part(part) for part in command.split(' ')]
+        self.format_string = ' '.join(
+            [self.get_format_string(part) for part in self.parts])
+        self.shell = shell
+        # Each part (or argument if there is no shell) is compiled into a
+        # tuple of its format string and a flag that indicates whether it
+        # contains slots. Parts without slots are stored as plain text:
+        self.part_formats = [self.get_part_format(part)
+                             for part in self.parts]
+        # The request that is sent to a worker consists of the parts
+        # without quotes:
+        self.request_format = ' '.join(
+            [self.get_format_string(self.compile_part(part, shell=False),
+                                    quote=False)
+             for part in command.split(' ')])
+        self.argv_formats = None
+        if not shell:
+            self.argv_formats = [
+                self.get_part_format(
+                    self.compile_part(argument, shell=False), quote=False)
+                for argument in split_arguments(command)]
+
+    def compile_part(self, command_part, shell=True):
+        """
+        This method compiles a part of the command into a list of tokens.
+        A token is either a literal string or a slot. Placeholders preceded
+        by the escape character are literal, and all escape characters are
+        removed.
+        A part of a shell command that consists of literal text only is
+        compiled into a single string, in which superfluous slashes are
+        removed.
+        @param command_part: Part of the command
+        @param shell: False if the part is an argument of a command that is
+            executed without a shell
+        @return: The list of tokens
+        """
+        tokens = []
+        literal = []
+        for index, character in enumerate(command_part):
+            slot = self.PLACEHOLDER_SLOTS.get(character)
+            if slot is not None and (
+                    index == 0 or
+                    command_part[index-1] != mc.ESCAPE_CHARACTER):
+                if literal:
+                    tokens.append(''.join(literal))
+                    literal = []
+                if index == 0 and slot == self.SLOT_FILE_WITHOUT_PATH:
+                    slot = self.SLOT_FILE
+                tokens.append(slot)
+            elif character != mc.ESCAPE_CHARACTER:
+                literal.append(character)
+        if not tokens and shell:
+            # A part without placeholders is only changed if it contains
+            # superfluous slashes, in which case it is put in quotes:
+            collapsed = remove_superfluous_slashes(command_part)
+            if collapsed != command_part:
+                collapsed = '\"' + collapsed + '\"'
+            return [collapsed.replace(mc.ESCAPE_CHARACTER, '')]
+        if literal:
+            tokens.append(''.join(literal))
+        return tokens
+
+    def has_slots(self, part):
+        """
+        This method checks whether a compiled part contains slots.
+        @param part: The compiled part
+        @return: True if the part contains at least one slot
+        """
+        return any(not isinstance(token, str) for token in part)
+
+    def get_part_format(self, part, quote=True):
+        """
+        This method returns the format string of a compiled part together
+        with a flag that indicates whether the part contains slots. The text
+        of a part without slots is returned as is.
+        @param part: The compiled part
+        @param quote: If False, no quotes are added
+        @return: Tuple of the format string (or text) and the flag
+        """
+        if self.has_slots(part):
+            return self.get_format_string(part, quote), True
+        return ''.join(part), False
+
+    def get_format_string(self, part, quote=True):
+        """
+        This method turns a compiled part into a format string for
+        str.format. Parts with slots are put in quotes to avoid problems with
+        special characters.
+        @param part: The compiled part
+        @param quote: If False, no quotes are added
+        @return: The format string
+        """
+        pieces = []
+        for token in part:
+            if isinstance(token, str):
+                pieces.append(token.replace('{', '{{').replace('}', '}}'))
+            else:
+                pieces.append('{' + str(token) + '}')
+        if quote and self.has_slots(part):
+            return '\"' + ''.join(pieces) + '\"'
+        return ''.join(pieces)
+
+    def uses_counter(self):
+        """
+        This method checks whether the command contains the counter.
+        @return: True if the counter placeholder is used
+        """
+        return any(self.SLOT_COUNTER in part for part in self.parts)
+
+    def get_values(self, filename, count):
+        """
+        This method computes the values of all slots for a particular file.
+        The values are ordered according to the slot numbers.
+        @param filename: The input filename
+        @param count: The current count
+        @return: Tuple of values
+        """
+        # Escape characters are removed from the file name:
+        if mc.ESCAPE_CHARACTER in filename:
+            filename = filename.replace(mc.ESCAPE_CHARACTER, '')
+        file_path, filename_without_path = os.path.split(filename)
+        # Append '/' if there is a path, i.e., the file is not in the local
+        # directory:
+        if file_path != '':
+            file_path += '/'
+        plain_filename, file_extension = os.path.splitext(
+            filename_without_path)
+        return (filename, filename_without_path, file_path, plain_filename,
+                file_extension, self.counter_format.format(count))
+
+    def build(self, filename, count):
+        """
+        This method builds the command for a particular file.
+        @param filename: The input filename
+        @param count: The current count
+        @return: The built command
+        """
+        command = self.format_string.format(*self.get_values(filename, count))
+        # Remove superfluous slashes and return:
+        if '//' in command:
+            command = remove_superfluous_slashes(command)
+        return command
+
+    def build_argv(self, filename, count):
+        """
+        This method builds the list of arguments for a particular file when
+        the command is executed without a shell.
+        @param filename: The input filename
+        @param count: The current count
+        @return: The list of arguments
+        """
+        values = self.get_values(filename, count)
+        argv = []
+        for format_string, has_slots in self.argv_formats:
+            if has_slots:
+                argument = format_string.format(*values)
+                if '//' in argument:
+                    argument = remove_superfluous_slashes(argument)
+                argv.append(argument)
+            else:
+                argv.append(format_string)
+        return argv
+
+    def build_request(self, filename, count):
+        """
+        This method builds the request for a particular file that is sent to
+        a worker. In contrast to a command, the values are not quoted.
+        @param filename: The input filename
+        @param count: The current count
+        @return: The request
+        """
+        return self.request_format.format(*self.get_values(filename, count))
+
+    def expand(self, filename, count):
+        """
+        This method fills the slots of all parts (or arguments if there is
+        no shell) that contain slots for a particular file. It is used to
+        build commands for batches of files.
+        @param filename: The input filename
+        @param count: The current count
+        @return: List of the filled parts
+        """
+        values = self.get_values(filename, count)
+        formats = self.part_formats if self.shell else self.argv_formats
+        expansion = []
+        for format_string, has_slots in formats:
+            if has_slots:
+                part = format_string.format(*values)
+                if '//' in part:
+                    part = remove_superfluous_slashes(part)
+                expansion.append(part)
+        return expansion
+
+    def get_size(self, expansion=None):
+        """
+        This method estimates the space that a command takes up in the
+        argument list of a new process, i.e., the length of each argument in
+        bytes including the terminating null byte and a pointer.
+        If an expansion is given, only the size of the filled parts is
+        returned, otherwise the size of the parts without slots.
+        @param expansion: The filled parts as returned by expand()
+        @return: The size in bytes
+        """
+        if expansion is not None:
+            if self.shell:
+                # The parts are appended to the single shell argument:
+                return sum([len(os.fsencode(part)) + 1 for part in expansion])
+            return sum([len(os.fsencode(part)) + 1 + POINTER_SIZE
+                        for part in expansion])
+        if self.shell:
+            return len(os.fsencode(' '.join(
+                [text for text, has_slots in self.part_formats
+                 if not has_slots]))) + 1
+        return sum([len(os.fsencode(text)) + 1 + POINTER_SIZE
+                    for text, has_slots in self.argv_formats
+                    if not has_slots])
+
+    def assemble(self, expansions):
+        """
+        This method builds a single command for a batch of files. Each part
+        (or argument if there is no shell) that contains slots is repeated
+        for every file in the batch, whereas the other parts occur once.
+        @param expansions: The filled parts of the files as returned by
+            expand()
+        @return: The command, which is a list of arguments if there is no
+            shell
+        """
+        formats = self.part_formats if self.shell else self.argv_formats
+        result = []
+        index = 0
+        for text, has_slots in formats:
+            if not has_slots:
+                result.append(text)
+                continue
+            if self.shell:
+                result.append(' '.join(
+                    [expansion[index] for expansion in expansions]))
+            else:
+                result.extend([expansion[index] for expansion in expansions])
+            index += 1
+        if self.shell:
+            return ' '.join(result)
+        return result
+
+
+def get_exit_code(status):
+    """
+    The method converts a wait status into a return code as used by the
+    subprocess module, i.e., a negative value denotes a signal.
+    @param status: The status returned by os.wait4
+    @return: The return code
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def iter_paths(stream, delimiter, close=False):
+    """
+    The method reads delimited paths from a binary stream in chunks and
+    yields them one by one. Empty paths are skipped. The paths are decoded
+    like file names, i.e., undecodable bytes are preserved.
+    @param stream: The binary stream
+    @param delimiter: The delimiter, e.g., b'\\n' or b'\\0'
+    @param close: If True, the stream is closed at the end
+    @return: Generator of paths
+    """
+    remainder = b''
+    try:
+        while True:
+            chunk = stream.read(mc.PATH_LIST_CHUNK_SIZE)
+            if not chunk:
+                break
+            paths = (remainder + chunk).split(delimiter)
+            remainder = paths.pop()
+            for path in paths:
+                if path:
+                    yield os.fsdecode(path)
+        if remainder:
+            yield os.fsdecode(remainder)
+    finally:
+        if close:
+            stream.close()
+
+
+def in_shard(path, shard):
+    """
+    The method checks whether a path belongs to a shard. The paths are
+    assigned to the shards by a hash of the path that does not change
+    between runs or hosts.
+    @param path: The path
+    @param shard: The tuple (index, count) of the shard
+    @return: True if the path belongs to the shard
+    """
+    index, count = shard
+    return zlib.crc32(path.encode('utf-8', 'surrogateescape')) % count == index
+
+
+def kill_process_group(pid):
+    """
+    The method kills the process group of a command that was started in a
+    new session, including all processes that the command has started.
+    @param pid: The process ID of the command, which is also the ID of its
+        process group
+    """
+    import signal
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        # The process group does not exist anymore:
+        pass
+
+
+def get_argument_limit(shell):
+    """
+    The method returns the number of bytes that the arguments of a new
+    process may take up. The limit is ARG_MAX minus the size of the
+    environment and some headroom. When using the shell, the whole command is
+    a single argument, which is limited to MAX_ARG_STRLEN on Linux.
+    @param shell: True if the commands are executed via the shell
+    @return: The limit in bytes
+    """
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (AttributeError, ValueError, OSError):
+        arg_max = -1
+    if arg_max <= 0:
+        arg_max = mc.DEFAULT_ARG_MAX
+    # The sizes are counted in bytes, which differs from the number of
+    # characters for non-ASCII names and values:
+    environment_size = sum([len(os.fsencode(key)) + len(os.fsencode(value)) +
+                            2 + POINTER_SIZE
+                            for key, value in os.environ.items()])
+    limit = arg_max - environment_size - mc.ARG_MAX_HEADROOM
+    if shell:
+        limit = min(limit, mc.MAX_ARG_STRLEN - 1)
+    return max(limit, 0)
+
+
+def split_arguments(command):
+    """
+    The method splits a command into arguments using the rules of the
+    shell, i.e., quotes group arguments. Unlike in the shell, the escape
+    character is retained so that escaped placeholders can be recognized,
+    and map_constants.PLACEHOLDER_EXTENSION does not start a comment.
+    @param command: The command
+    @return: The list of arguments
+    """
+    lexer = shlex.shlex(command, posix=True)
+    lexer.whitespace_split = True
+    lexer.commenters = ''
+    lexer.escape = ''
+    return list(lexer)
+
+
+def format_command(command):
+    """
+    The method returns the printable form of a command. Commands that are
+    executed without a shell are lists of arguments, which are quoted so
+    that they can be pasted into a shell.
+    @param command: The command
+    @return: The command as a string
+    """
+    if isinstance(command, list):
+        return ' '.join([shlex.quote(argument) for argument in command])
+    return command
+
+
+def remove_superfluous_slashes(input_string):
+    """
+    The method replaces any sequence of slashes by a single slash.
+    @param input_string: The input string
+    @return: The string without superfluous slashes
+    """
+    while '//' in input_string:
+        input_string = input_string.replace('//', '/')
+    return input_string
+
+
+class MapRunner(object):
+    """
+    MapRunner sets up a map run for a set of parsed arguments. It is shared
+    by the command line interface (MapStarter) and the Python API
+    (map_api). A run consists of the steps
+
+        get_entries()       collects the input files (or directories),
+        get_jobs(entries)   builds the jobs for the input, and
+        finish()            records the statistics and the listing cache,
+
+    with the jobs being executed by the MapExecutor 'executor' in between.
+    """
+
+    def __init__(self, args):
+        """
+        The constructor checks the arguments and opens the journal, the
+        event file, and the listing cache. A ValueError is raised if the
+        arguments are invalid, and an IOError is raised if a file cannot be
+        opened.
+        @param args: The parsed map arguments
+        """
+        self.args = args
+        if args.directories and args.extensions is not None:
+            raise ValueError('the extensions cannot be used with -d')
+
+        # The input read from a file is processed in the order of the file:
+        if args.from_file is not None:
+            if args.path or args.recursive:
+                raise ValueError('--from-file cannot be used with a path or '
+                                 '-r')
+            if args.from_file != '-' and not os.path.exists(args.from_file):
+                raise IOError('cannot open the input file: ' +
+                              args.from_file)
+            args.stream = True
+        elif args.null and args.worker is None:
+            raise ValueError('-0 requires --from-file or --worker')
+
+        # Workers handle one file per request, and they write their replies
+        # to the standard output:
+        if args.worker is not None and (
+                args.batch or args.max_batch > 0 or args.group_output or
+                args.engine != mc.ENGINE_THREADS):
+            raise ValueError('--worker cannot be used with -b, --max-batch, '
+                             '-g, or --engine')
+
+        # Jobs can only be reordered if all of them are known in advance, and
+        # directories must be processed before their parent directories:
+        if args.schedule == mc.SCHEDULE_LARGEST_FIRST and (
+                args.stream or args.directories):
+            raise ValueError('the schedule ' + mc.SCHEDULE_LARGEST_FIRST +
+                             ' cannot be used with -s or -d')
+
+        # Sharding directory trees requires a shard, and the counter values
+        # would depend on the input of the other shards:
+        if args.shard_directories and args.shard is None:
+            raise ValueError('--shard-directories requires --shard')
+
+        # A directory and the directories in it must be in the same shard so
+        # that the directories in it are processed first:
+        if args.shard is not None and args.directories and \
+                not args.shard_directories:
+            raise ValueError('--shard requires --shard-directories with -d')
+
+        # New and changed entries are found under the provided paths, and
+        # the counter must continue across the batches of a watch:
+        if args.watch and (args.from_file is not None or
+                           args.shard_directories):
+            raise ValueError('--watch cannot be used with --from-file or '
+                             '--shard-directories')
+
+        # The journal is opened if the run can be resumed:
+        journal = None
+        if args.journal is not None:
+            from map.map_journal import MapJournal
+            try:
+                journal = MapJournal(args.journal)
+            except IOError as error:
+                raise IOError('cannot open the journal: ' + str(error))
+
+        # The statistics are collected if requested:
+        self.statistics = None
+        if args.stats or args.events is not None:
+            from map.map_stats import MapStatistics
+            try:
+                self.statistics = MapStatistics(args.events)
+            except IOError as error:
+                raise IOError('cannot open the event file: ' + str(error))
+
+        # The command is compiled before the input is collected:
+        self.executor = MapExecutor(journal, self.statistics)
+        try:
+            template = self.executor.get_template(args)
+        except ValueError as error:
+            raise ValueError('invalid command: ' + str(error))
+        if args.shard_directories and template.uses_counter():
+            raise ValueError(
+                'the counter cannot be used with --shard-directories')
+        # Several threads stream the entries in the order in which the
+        # directories are read, so the counter values differ between runs,
+        # which must not happen if the runs are combined or resumed:
+        if args.stream and args.recursive and args.walk_threads != 1 and \
+                template.uses_counter() and (
+                    args.shard is not None or args.journal is not None):
+            raise ValueError('the counter cannot be used with --shard or '
+                             '--journal if -s is used with --walk-threads')
+
+        # Results are cached per input file and must not depend on the
+        # counter:
+        if args.result_cache is not None:
+            self.executor.result_cache = self.get_result_cache(template)
+        elif args.cache_output:
+            raise ValueError('--cache-output requires --result-cache')
+
+        # The directory listings of previous runs are loaded if requested:
+        self.listing_cache = None
+        if args.listing_cache is not None:
+            from map.map_listing_cache import MapListingCache
+            self.listing_cache = MapListingCache(
+                args.listing_cache, args.listing_cache_size,
+                args.refresh_cache)
+
+        # The patterns are compiled before the input is collected:
+        path_filter = None
+        if args.exclude or args.include or args.max_depth > 0:
+            path_filter = MapPathFilter(args.exclude, args.include,
+                                        args.regex, args.max_depth)
+
+        # The size and modification time are needed to consult the journal:
+        self.input_handler = MapInputHandler(
+            with_stat=journal is not None or
+            args.schedule == mc.SCHEDULE_LARGEST_FIRST,
+            listing_cache=self.listing_cache,
+            shard=args.shard if args.shard_directories else None,
+            path_filter=path_filter, dedup_inodes=args.dedup_inodes,
+            follow_symlinks=args.follow_symlinks)
+
+    def get_result_cache(self, template):
+        """
+        This method opens the result cache. A ValueError is raised if the
+        results cannot be cached, and an IOError is raised if the cache
+        directory cannot be created.
+        @param template: The compiled MapCommandTemplate of the command
+        @return: The MapResultCache
+        """
+        args = self.args
+        if args.batch or args.max_batch > 0 or args.directories or \
+                args.worker is not None:
+            raise ValueError('--result-cache cannot be used with -b, '
+                             '--max-batch, -d, or --worker')
+        output_templates = [MapCommandTemplate(output, args.number_length)
+                            for output in args.cache_output or []]
+        if template.uses_counter() or any(
+                [output.uses_counter() for output in output_templates]):
+            raise ValueError('the counter cannot be used with '
+                             '--result-cache')
+        from map.map_result_cache import MapResultCache
+        try:
+            return MapResultCache(args.result_cache, template,
+                                  output_templates,
+                                  args.result_cache_size * 1048576)
+        except OSError as error:
+            raise IOError('cannot open the result cache: ' + str(error))
+
+    def get_entries(self):
+        """
+        This method collects the input files (or directories). When
+        streaming, the input is only collected as it is consumed.
+        @return: List or iterator of MapEntry objects, or an empty list if
+            there is no input
+        """
+        if self.args.stream:
+            entries = self.input_handler.iter_entries(self.args)
+            if self.statistics is not None:
+                entries = self.statistics.timed(entries, 'get_files')
+            # The first file is fetched to check whether there is any input:
+            first_entry = next(entries, None)
+            if first_entry is None:
+                return []
+            return itertools.chain([first_entry], entries)
+        start = time.time()
+        entries = self.input_handler.get_entries(self.args)
+        if self.statistics is not None:
+            self.statistics.add_stage_time('get_files', time.time() - start)
+        return entries
+
+    def get_jobs(self, entries):
+        """
+        This method creates the jobs for the input. The commands are built
+        while they are being executed (or listed), unless the jobs are
+        reordered by the schedule.
+        @param entries: The MapEntry objects returned by get_entries()
+        @return: Iterable of MapJob objects in the order of dispatching
+        """
+        jobs = self.executor.iter_jobs(entries, self.args)
+        if self.statistics is not None:
+            jobs = self.statistics.timed(jobs, 'build_commands', 'get_files')
+        # All jobs must be known before they can be reordered:
+        if self.args.schedule == mc.SCHEDULE_LARGEST_FIRST:
+            jobs = self.executor.schedule_jobs(list(jobs), self.args)
+        return jobs
+
+    def finish(self, print_summary=False):
+        """
+        This method completes the run: the journal is closed, the statistics
+        are written, and the result cache and the listing cache are saved.
+        @param print_summary: If True, the statistics are printed
+        """
+        self.executor.close()
+        if self.statistics is not None:
+            self.statistics.finish(print_summary)
+
+        # Old results are evicted once all results have been stored:
+        result_cache = self.executor.result_cache
+        if result_cache is not None:
+            if self.args.verbose:
+                print(result_cache.get_summary())
+            try:
+                result_cache.close()
+            except (IOError, OSError) as error:
+                sys.stderr.write('map: cannot save the result cache: ' +
+                                 str(error) + '\n')
+
+        # The listings are saved once the input has been consumed:
+        if self.listing_cache is not None:
+            if self.args.verbose:
+                print('Listing cache: ' + str(self.listing_cache.hits) +
+                      ' hit(s), ' + str(self.listing_cache.misses) +
+                      ' miss(es).')
+            try:
+                self.listing_cache.save()
+            except (IOError, OSError) as error:
+                sys.stderr.write('map: cannot save the listing cache: ' +
+                                 str(error) + '\n')
 
 
 class MapStarter(object):
     """ The MapStarter class is used to initiate the mapping process.
-    It uses a MapArgumentParser instance to parse the input, a
-    MapInputHandler to load the input that needs to be mapped, and then
-    uses a MapExecutor instance to process the input.
+    It uses a MapArgumentParser instance to parse the input and a
+    MapRunner to load the input that needs to be mapped, and then
+    uses the runner's MapExecutor instance to process the input.
     """
 
     def map(self):
@@ -397,27 +2116,69 @@ class MapStarter(object):
         # The arguments are parsed and returned:
         args = parser.parse_args()
 
+        # The run is set up, which fails if the arguments are inconsistent:
+        try:
+            runner = MapRunner(args)
+        except (ValueError, IOError) as error:
+            parser.error(str(error))
+
+        # In watch mode, the changes are recorded before the input is
+        # collected so that none of them are missed. SIGTERM stops a watch
+        # like SIGINT, also during the initial run, so that the run is
+        # finished when map is stopped by a supervisor:
+        watcher = None
+        if args.watch:
+            import signal
+            from map.map_watch import MapWatcher, raise_interrupt
+            signal.signal(signal.SIGTERM, raise_interrupt)
+            watcher = MapWatcher(runner)
+            watcher.start()
+
+        try:
+            self.run(runner, watcher)
+        except KeyboardInterrupt:
+            # Only a watch is ended by an interrupt:
+            if watcher is None:
+                raise
+        if watcher is not None:
+            watcher.close()
+
+        runner.finish(args.stats)
+
+    def run(self, runner, watcher):
+        """ The method collects the input and executes the commands. In watch
+        mode, the changes are processed afterwards until map is interrupted.
+        @param runner: The MapRunner of the run
+        @param watcher: The MapWatcher, or None if map does not watch
+        """
+        args = runner.args
+
         # The target files (or folders) are collected for the map job:
         if args.verbose:
             print('Collecting input for the map process...')
-        input_handler = MapInputHandler()
-        files = input_handler.get_files(args)
+        entries = runner.get_entries()
 
         # If there are no files (or folders), there is nothing to do:
-        if not files:
+        if not entries and watcher is None:
             sys.stdout.write('No input for the map process found.\n')
             sys.exit(1)
 
-        # If there is at least one file (or folder), create a MapExecutor:
-        executor = MapExecutor()
-
-        # Create the commands for the input files:
-        commands = executor.build_commands(files, args)
+        # Create the jobs for the input files. In watch mode, the entries
+        # are tracked so that they are not processed again:
+        if watcher is not None:
+            entries = watcher.track(entries)
+        jobs = runner.get_jobs(entries)
 
-        # Finally, the commands are executed sequentially:
+        # Finally, the commands are executed (in parallel if requested):
         if args.verbose:
             print('Executing commands...')
-        executor.run_commands(commands, args)
+        errors = runner.executor.run_jobs(jobs, args)
+
+        # The changes are processed until map is interrupted:
+        if watcher is not None and (errors == 0 or args.ignore_errors):
+            if args.verbose:
+                print('Waiting for changes...')
+            watcher.watch()
 
 
 if __name__ == "__main__":
@@ -26,6 +26,7 @@ setup(name = "map",
     https://github.com/THLO/map or by running map --help.",
     license = 'GNU General Public License v3 (GPLv3)',
     platforms = 'POSIX',
+    python_requires = '>=3.5',
     classifiers = [
         'Development Status :: 5 - Production/Stable',
         'Environment :: Console',
@@ -34,6 +35,7 @@ setup(name = "map",
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Operating System :: POSIX :: Linux',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
         'Topic :: Desktop Environment',
       ]
 )